@@ -0,0 +1,78 @@
+"""
+Task-preparation benchmark: per-row iterrows + strptime tasks (previous process_data)
+against the vectorized detection table.
+
+Usage: python benchmarks/detection_table.py [--rows N]
+"""
+import os
+import sys
+import time
+import argparse
+import datetime
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detection_table import detection_table_from_df
+
+MAX_TIME_DIFF_HOURS = 10
+BUFFER_METERS = 2000
+
+def synthetic_firms(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    epochs = rng.integers(1_450_000_000, 1_700_000_000, rows)
+    return pd.DataFrame({
+        'latitude': rng.uniform(-35, -30, rows).round(5),
+        'longitude': rng.uniform(-58, -53, rows).round(5),
+        'acq_date': pd.to_datetime(epochs, unit='s').strftime('%Y-%m-%d'),
+        'acq_time': rng.integers(0, 24, rows) * 100 + rng.integers(0, 60, rows),
+        'frp': rng.uniform(0, 50, rows),
+    })
+
+def iterrows_tasks(df):
+    """What process_data / process_single_point did per detection before the detection table."""
+    tasks = []
+    for idx, row in df.iterrows():
+        time_str = str(row['acq_time']).zfill(4)
+        datetime_str = f"{row['acq_date']}T{time_str[:2]}:{time_str[2:]}:00"
+        alert_dt = datetime.datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+        window = (alert_dt - datetime.timedelta(hours=MAX_TIME_DIFF_HOURS), alert_dt + datetime.timedelta(hours=MAX_TIME_DIFF_HOURS))
+        tasks.append((idx, row, window))
+    return tasks
+
+def table_tasks(df):
+    table = detection_table_from_df(df, MAX_TIME_DIFF_HOURS, BUFFER_METERS)
+    return table, range(len(table))
+
+def measure(func, df):
+    """Wall time of a plain run and peak traced memory of a second run (tracemalloc slows code down)."""
+    start = time.perf_counter()
+    result = func(df)
+    elapsed = time.perf_counter() - start
+    del result
+
+    tracemalloc.start()
+    result = func(df)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare task preparation with iterrows against the detection table.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    df = synthetic_firms(args.rows)
+
+    _, old_time, old_peak = measure(iterrows_tasks, df)
+    (table, _), new_time, new_peak = measure(table_tasks, df)
+
+    print(f"{args.rows} detections")
+    print(f"iterrows + strptime : {old_time:8.2f} s  peak {old_peak / 1e6:8.1f} MB")
+    print(f"detection table     : {new_time:8.2f} s  peak {new_peak / 1e6:8.1f} MB  (table {table.nbytes / 1e6:.1f} MB)")
+    print(f"speedup x{old_time / new_time:.0f}, memory x{old_peak / new_peak:.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Import-time benchmark for the project modules.
+
+Each module is imported in a fresh interpreter, timing the import and checking
+that no heavy dependency was pulled in and no file or directory was created.
+The cost of importing the heavy dependencies directly is reported as the startup
+time saved by importing them lazily.
+
+Usage: python benchmarks/import_time.py [--repeat N]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "download_firms_data",
+    "collect_images",
+    "collect_no_fire_images",
+    "generate_clean_df_data",
+    "filter_firms_dataset_sector",
+    "plot_firms_time_distribution",
+    "metrics",
+    "firms_cube",
+    "scheduling",
+    "detection_table",
+    "thumbnail_quality",
+    "patches",
+    "countries",
+    "pipeline",
+    "collection_plan",
+    "thumbnail_derivatives",
+    "run_dirs",
+]
+
+HEAVY_MODULES = ["ee", "geopandas", "shapely", "sklearn", "matplotlib"]
+
+PROBE = """
+import os, sys, json, time
+before = set(os.listdir("."))
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy_loaded": [m for m in {heavy!r} if m in sys.modules],
+    "created": sorted(set(os.listdir(".")) - before),
+}}))
+"""
+
+def run_probe(code):
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPO_DIR, capture_output=True, text=True
+    )
+    if out.returncode != 0:
+        return None, out.stderr.strip().splitlines()[-1]
+    return json.loads(out.stdout.strip().splitlines()[-1]), None
+
+def time_import(module, repeat):
+    results = []
+    for _ in range(repeat):
+        result, error = run_probe(PROBE.format(module=module, heavy=HEAVY_MODULES))
+        if error:
+            return None, error
+        results.append(result)
+    summary = results[-1]
+    summary["seconds"] = statistics.median(r["seconds"] for r in results)
+    return summary, None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time of the project modules.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'module':32s} {'import (ms)':>12s}  heavy deps loaded / files created")
+    failures = 0
+    for module in MODULES:
+        summary, error = time_import(module, args.repeat)
+        if error:
+            print(f"{module:32s} {'error':>12s}  {error}")
+            failures += 1
+            continue
+        problems = summary["heavy_loaded"] + summary["created"]
+        failures += bool(problems)
+        print(f"{module:32s} {summary['seconds'] * 1000:12.1f}  {', '.join(problems) or '-'}")
+
+    print()
+    print("Startup saved by lazy imports (cost of importing each dependency eagerly):")
+    for module in HEAVY_MODULES:
+        import_name = "matplotlib.pyplot" if module == "matplotlib" else module
+        summary, error = time_import(import_name, args.repeat)
+        if error:
+            print(f"{import_name:32s} {'n/a':>12s}  {error}")
+        else:
+            print(f"{import_name:32s} {summary['seconds'] * 1000:12.1f}")
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
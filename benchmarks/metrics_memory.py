@@ -0,0 +1,76 @@
+"""
+Wall time and peak memory of metrics.get_metrics on synthetic merged feature CSVs of
+several sizes. Each size runs in a fresh interpreter; peak RSS is reported for the
+main process and for the largest worker, and should not grow with the number of rows.
+The world map is skipped (it needs the Natural Earth download).
+
+Usage: python benchmarks/metrics_memory.py [--rows 1000000 4000000] [--chunksize N] [--workers N]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import sys, json, time, resource
+sys.path.insert(0, {repo!r})
+import metrics
+metrics.save_world_fire_map = lambda df, output_dir: None
+start = time.perf_counter()
+metrics.get_metrics({csv!r}, {out!r}, chunksize={chunksize!r}, num_workers={workers!r})
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "main_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "worker_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+}}))
+"""
+
+def write_synthetic_features(path, rows, block=1_000_000, seed=0):
+    rng = np.random.default_rng(seed)
+    header = True
+    for start in range(0, rows, block):
+        n = min(block, rows - start)
+        dates = pd.to_datetime('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650 * 86400, n), unit='s')
+        pd.DataFrame({
+            'latitude': rng.uniform(-35, -30, n).round(4),
+            'longitude': rng.uniform(-58, -53, n).round(4),
+            'FIRMS_date': dates.strftime('%Y-%m-%dT%H:%M:%S'),
+            'cloud_pct': rng.uniform(0, 100, n).round(2),
+            'thumbnail_file': [f"point_{i}.png" for i in range(start, start + n)],
+            'country': rng.choice(['Uruguay', 'Brazil', 'Argentina'], n),
+            'firms_sensor': 'J1',
+        }).to_csv(path, mode='a', header=header, index=False)
+        header = False
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Peak memory of the out-of-core metrics versus input size.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 4_000_000])
+    parser.add_argument("--chunksize", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            csv_path = os.path.join(tmp, f"merged_{rows}.csv")
+            # Generated in a child process: peak RSS is inherited by the probe interpreter
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                executor.submit(write_synthetic_features, csv_path, rows).result()
+            code = PROBE.format(repo=REPO_DIR, csv=csv_path, out=os.path.join(tmp, f"metrics_{rows}"), chunksize=args.chunksize, workers=args.workers)
+            out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+            results.append((rows, json.loads(out.stdout.strip().splitlines()[-1])))
+            os.remove(csv_path)
+
+    print(f"{'rows':>12s} {'seconds':>9s} {'main MB':>9s} {'worker MB':>10s}")
+    for rows, r in results:
+        print(f"{rows:12d} {r['seconds']:9.1f} {r['main_mb']:9.0f} {r['worker_mb']:10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Peak memory of process_data streaming a synthetic FIRMS CSV, for several input sizes.
+
+The Earth Engine work of each detection is replaced by a no-op so that only the scheduling
+(chunked reading, detection tables, bounded in-flight window, progress) is measured. Peak
+traced memory must stay flat as the number of rows grows: the script exits with 1 if the
+peak of any size exceeds the peak of the smallest one by more than --tolerance.
+
+Usage: python benchmarks/streaming_memory.py [--rows 1000000 10000000] [--chunk-size 100000] [--tolerance 0.25]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import collect_images
+from collect_images import CollectConfig, count_csv_rows, process_data, stream_detections
+
+def write_synthetic_firms(path, rows, block=1_000_000, seed=0):
+    rng = np.random.default_rng(seed)
+    header = True
+    for start in range(0, rows, block):
+        n = min(block, rows - start)
+        epochs = rng.integers(1_450_000_000, 1_700_000_000, n)
+        pd.DataFrame({
+            'latitude': rng.uniform(-35, -30, n).round(5),
+            'longitude': rng.uniform(-58, -53, n).round(5),
+            'acq_date': pd.to_datetime(epochs, unit='s').strftime('%Y-%m-%d'),
+            'acq_time': rng.integers(0, 24, n) * 100 + rng.integers(0, 60, n),
+            'frp': rng.uniform(0, 50, n).round(2),
+        }).to_csv(path, mode='a', header=header, index=False)
+        header = False
+
+def noop_point(position, table, config, budget=None):
+    return True
+
+def run(csv_path, output_dir, chunk_size, num_threads):
+    config = CollectConfig(
+        gee_project=None,
+        images_satellite="sentinel-2",
+        country="Synthetic",
+        firms_instrument="VIIRS S-NPP",
+        csv_path=csv_path,
+        output_img_dir=output_dir,
+        num_threads=num_threads,
+        chunk_size=chunk_size,
+    )
+    os.makedirs(output_dir, exist_ok=True)
+
+    total = count_csv_rows(csv_path)
+    tracemalloc.start()
+    start = time.perf_counter()
+    process_data(stream_detections(csv_path, config), config, total=total)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total, elapsed, peak
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Peak memory of streamed process_data versus input size.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed growth of the peak over the smallest size (fraction)")
+    args = parser.parse_args(argv)
+
+    collect_images.process_single_point = noop_point
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = []
+        for rows in sorted(args.rows):
+            csv_path = os.path.join(tmp, f"firms_{rows}.csv")
+            write_synthetic_firms(csv_path, rows)
+            total, elapsed, peak = run(csv_path, os.path.join(tmp, f"run_{rows}"), args.chunk_size, args.threads)
+            results.append((total, elapsed, peak))
+            os.remove(csv_path)
+
+    limit = results[0][2] * (1 + args.tolerance)
+    failures = 0
+    print(f"{'rows':>12s} {'seconds':>9s} {'peak MB':>9s}")
+    for total, elapsed, peak in results:
+        failures += peak > limit
+        print(f"{total:12d} {elapsed:9.1f} {peak / 1e6:9.1f}  {'above ' + f'{limit / 1e6:.1f} MB' if peak > limit else '-'}")
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,79 +1,249 @@
+import io
 import os
-import ee
 import json
 import shutil
+import argparse
 import requests
 import datetime
 import pandas as pd
 from tqdm import tqdm
 from pathlib import Path
+import numpy as np
+import tempfile
+import contextlib
+import multiprocessing
 import concurrent.futures
 from datetime import timezone
+from dataclasses import dataclass
 from geopy.distance import geodesic
 
-from download_firms_data import download_firms_data
+from download_firms_data import download_firms_data, firms_csv_path
+from scheduling import Budget, bounded_map, prioritize, unless_exhausted
+from patches import NATIVE_SCALES, REFLECTANCE_SCALE, RGB_BANDS, STRETCH, download_patch
+from mosaic import MOSAIC_MAX_PIXELS, crop_mosaic, mosaic_cells, mosaic_grid, mosaic_tiles
+from detection_table import METERS_PER_DEGREE, detection_table_from_df, epoch_to_datetime, epoch_to_str, firms_epochs, region_coordinates
 
 CONFG_FILE_NAME = "config/collect_images_config.json"
 
-with open(CONFG_FILE_NAME, "r") as f:
-    config = json.load(f)
-
-GEE_PROJECT = config.get("GEE_PROJECT")
-
-print(f"Config loaded: {config}")
-
-old_run_dir = config.get("OLD_RUN_DIR", False)
-
-old_run = old_run_dir if old_run_dir and old_run_dir != "False" else False
-
-if old_run_dir and not os.path.exists(old_run_dir):
-    print(f"Previous run dir {old_run_dir} not found, starting new run.")
-    old_run = False
-
-if old_run:
-    print(f"Loading previous run {old_run}")
-    with open(f"{old_run}/config.json", "r") as f:
+DEFAULT_BUFFER_METERS = 2000
+DEFAULT_THUMB_SIZE = 1024
+
+PENDING_FILE = "pending.csv"
+
+# Coordinates and acquisition times of the detections of the input of a run, and the next free
+# det_id / event_id, so that a changed input is matched by detection instead of by position
+INPUT_KEYS_FILE = "input_keys.npz"
+
+COLUMNS = ['latitude', 'longitude', 'FIRMS_date', 'image_date', 'date_diff_hours', 'cloud_pct', 'thumbnail_file', 'satellite_image_source', 'detecion_source', 'local_cloud_pct', 'event_id', 'pixel_x', 'pixel_y', 'local_valid_pct', 'patch_file']
+
+# "point": one thumbnail per FIRMS detection.
+# "event": detections of the same acquisition clustered into fire events, one thumbnail per event.
+# "mosaic": one thumbnail per detection, cropped locally from one download per image (wide-swath satellites).
+# "stack": all the frames of a detection (MAX_IMAGES_PER_POINT) in one filmstrip request, split locally.
+COLLECTION_MODES = ["point", "event", "mosaic", "stack"]
+
+# Satellites whose images cover the whole area of interest, where "mosaic" mode pays off
+MOSAIC_SATELLITES = ["aqua", "fengyun"]
+
+# In "mosaic" mode detections are searched together in groups of this many days
+MOSAIC_GROUP_DAYS = 7
+
+# Crops cut per worker task in "mosaic" mode
+CROP_BATCH = 32
+
+# "thumbnail": 8-bit RGB PNG per image.
+# "patch": all PATCH_BANDS (RGB + NIR/SWIR) as a compressed array per image, rendered locally with patches.py.
+# "both": thumbnail and patch.
+EXPORT_MODES = ["thumbnail", "patch", "both"]
+
+# "earliest": first images in the time window that pass the scene-level cloud filter.
+# "local_cloud": images ranked by time difference and cloud cover inside the buffer.
+SELECTION_MODES = ["earliest", "local_cloud"]
+
+# Scale (meters) at which the pixel QA band is reduced over the buffer, per satellite.
+LOCAL_CLOUD_SCALES = {
+    "sentinel-2": 20,
+    "landsat-8": 30,
+    "aqua": 1000
+}
+
+
+# Bands an image must have to be downloaded, per satellite.
+REQUIRED_BANDS = {
+    "sentinel-2": ['B8', 'B4', 'B3', 'B12'],
+    "landsat-8": ['SR_B5', 'SR_B4', 'SR_B3', 'SR_B7'],
+    "aqua": ['sur_refl_b01', 'sur_refl_b02', 'sur_refl_b07'],
+    "fengyun": ['Channel0001', 'Channel0002', 'Channel0003']
+}
+
+# Image properties read by image_record, fetched for all the frames of a stack in one request.
+FRAME_PROPERTIES = ['system:time_start', 'CLOUDY_PIXEL_PERCENTAGE', 'LOCAL_CLOUD_PCT', 'LOCAL_VALID_PCT']
+
+
+@dataclass
+class CollectConfig:
+    """Resolved settings for one image collection run."""
+    gee_project: str
+    images_satellite: str
+    country: str
+    firms_instrument: str
+    csv_path: str
+    output_img_dir: str
+    buffer_meters: float = DEFAULT_BUFFER_METERS
+    thumb_size: int = DEFAULT_THUMB_SIZE
+    max_images_per_point: int = 1
+    max_time_diff_hours: float = 10
+    cloud_filter_percentage: float = 85
+    num_threads: int = 4
+    selection_mode: str = "earliest"
+    cloud_score_weight: float = 0.5
+    min_valid_pct: float = None
+    priority: str = "newest"
+    collection_mode: str = "point"
+    export_mode: str = "thumbnail"
+    patch_scale: float = None
+    event_max_km: float = 3
+    chunk_size: int = None
+    max_in_flight: int = None
+    max_run_seconds: float = None
+    max_rpcs: int = None
+    max_download_bytes: int = None
+    old_run: str = None
+    config_file: str = CONFG_FILE_NAME
+
+    @property
+    def output_csv(self):
+        return f"{self.output_img_dir}/firms_features.csv"
+
+    @property
+    def detection_source(self):
+        return self.csv_path.split('/')[-1].replace('.csv', '')
+
+
+def load_config(config_file=CONFG_FILE_NAME):
+    """
+    Reads the collection config (or the config saved in OLD_RUN_DIR when resuming)
+    and resolves paths and per-satellite values. No files or directories are created.
+    """
+    with open(config_file, "r") as f:
         config = json.load(f)
-        print(f"Previous config loaded: {config}")
 
-    OUTPUT_IMG_DIR = old_run
+    print(f"Config loaded: {config}")
 
-FIRMS_INSTRUMENT = config.get("FIRMS_INSTRUMENT")
-COUNTRY = config.get("COUNTRY")
+    gee_project = config.get("GEE_PROJECT")
 
-with open("config/instrument_map.json", "r") as f:
-    insrtument_map = json.load(f)
+    old_run_dir = config.get("OLD_RUN_DIR", False)
 
-CSV_PATH = config.get("CSV_PATH", None)
+    old_run = old_run_dir if old_run_dir and old_run_dir != "False" else None
 
-if CSV_PATH is None or CSV_PATH == "" or CSV_PATH.lower() == "null":
-    
-    CSV_PATH = f"data/firms_data/{FIRMS_INSTRUMENT.replace(' ', '_')}/{COUNTRY}/{insrtument_map[FIRMS_INSTRUMENT]}_{COUNTRY.replace(' ', '_')}.csv"
-
-    if not os.path.exists(CSV_PATH):
-        print(f"FIRMS CSV file not found {CSV_PATH}, downloading...")
-        download_firms_data(COUNTRY, FIRMS_INSTRUMENT)
+    if old_run_dir and not os.path.exists(old_run_dir):
+        print(f"Previous run dir {old_run_dir} not found, starting new run.")
+        old_run = None
 
-NUM_THREADS = config.get("NUM_THREADS", 4)
+    if old_run:
+        print(f"Loading previous run {old_run}")
+        with open(f"{old_run}/config.json", "r") as f:
+            config = json.load(f)
+            print(f"Previous config loaded: {config}")
 
-IMAGES_SATELLITE = config["IMAGES_SATELLITE"]
+    firms_instrument = config.get("FIRMS_INSTRUMENT")
+    country = config.get("COUNTRY")
+    images_satellite = config["IMAGES_SATELLITE"]
 
-if not old_run:
-    OUTPUT_IMG_DIR = f"data/{CSV_PATH.split('/')[-1].replace('.csv','')}_{IMAGES_SATELLITE}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    csv_path = config.get("CSV_PATH", None)
 
-THUMB_SIZE = config["THUMB_SIZE"]
-MAX_IMAGES_PER_POINT = config["MAX_IMAGES_PER_POINT"]
-MAX_TIME_DIFF_HOURS = config["MAX_TIME_DIFF_HOURS"]
-CLOUD_FILTER_PERCENTAGE = config["CLOUD_FILTER_PERCENTAGE"]
-OUTPUT_CSV = f"{OUTPUT_IMG_DIR}/firms_features.csv"
+    if csv_path is None or csv_path == "" or csv_path.lower() == "null":
+        csv_path = firms_csv_path(country, firms_instrument)
 
-# Set buffer depending on satellite type
-BUFFER_METERS = config["BUFFER_METERS"].get(IMAGES_SATELLITE, config["BUFFER_METERS"]["default"])
+    if old_run:
+        output_img_dir = old_run
+    elif config.get("OUTPUT_DIR"):
+        output_img_dir = config["OUTPUT_DIR"]
+    else:
+        output_img_dir = f"data/{csv_path.split('/')[-1].replace('.csv','')}_{images_satellite}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    # Set buffer depending on satellite type
+    buffer_meters = config["BUFFER_METERS"]
+    if isinstance(buffer_meters, dict):
+        buffer_meters = buffer_meters.get(images_satellite, buffer_meters["default"])
+
+    budget = config.get("BUDGET") or {}
+
+    selection_mode = config.get("SELECTION_MODE", "earliest")
+
+    if selection_mode not in SELECTION_MODES:
+        raise ValueError(f"Invalid SELECTION_MODE {selection_mode}. Options are: {SELECTION_MODES}")
+
+    if selection_mode == "local_cloud" and images_satellite not in LOCAL_CLOUD_SCALES:
+        raise ValueError(f"SELECTION_MODE local_cloud not supported for {images_satellite}. Options are: {list(LOCAL_CLOUD_SCALES)}")
+
+    collection_mode = config.get("COLLECTION_MODE", "point")
+
+    if collection_mode not in COLLECTION_MODES:
+        raise ValueError(f"Invalid COLLECTION_MODE {collection_mode}. Options are: {COLLECTION_MODES}")
+
+    export_mode = config.get("EXPORT_MODE", "thumbnail")
+
+    if export_mode not in EXPORT_MODES:
+        raise ValueError(f"Invalid EXPORT_MODE {export_mode}. Options are: {EXPORT_MODES}")
+
+    if collection_mode == "mosaic":
+        if images_satellite not in MOSAIC_SATELLITES:
+            raise ValueError(f"COLLECTION_MODE mosaic not supported for {images_satellite}. Options are: {MOSAIC_SATELLITES}")
+        if selection_mode != "earliest" or export_mode != "thumbnail" or config.get("MIN_VALID_PCT") is not None:
+            raise ValueError("COLLECTION_MODE mosaic only supports SELECTION_MODE earliest, EXPORT_MODE thumbnail and no MIN_VALID_PCT.")
+
+    if collection_mode == "stack" and export_mode != "thumbnail":
+        raise ValueError("COLLECTION_MODE stack only supports EXPORT_MODE thumbnail.")
+
+    chunk_size = config.get("CHUNK_SIZE")
+
+    if chunk_size and config.get("PRIORITY", "newest") != "newest":
+        raise ValueError("PRIORITY needs the whole dataset in memory and cannot be combined with CHUNK_SIZE.")
+
+    return CollectConfig(
+        gee_project=gee_project,
+        images_satellite=images_satellite,
+        country=country,
+        firms_instrument=firms_instrument,
+        csv_path=csv_path,
+        output_img_dir=output_img_dir,
+        buffer_meters=buffer_meters,
+        thumb_size=config["THUMB_SIZE"],
+        max_images_per_point=config["MAX_IMAGES_PER_POINT"],
+        max_time_diff_hours=config["MAX_TIME_DIFF_HOURS"],
+        cloud_filter_percentage=config["CLOUD_FILTER_PERCENTAGE"],
+        num_threads=config.get("NUM_THREADS", 4),
+        selection_mode=selection_mode,
+        cloud_score_weight=config.get("CLOUD_SCORE_WEIGHT", 0.5),
+        min_valid_pct=config.get("MIN_VALID_PCT"),
+        priority=config.get("PRIORITY", "newest"),
+        collection_mode=collection_mode,
+        event_max_km=config.get("EVENT_MAX_KM", 3),
+        export_mode=export_mode,
+        patch_scale=config.get("PATCH_SCALE"),
+        chunk_size=chunk_size,
+        max_in_flight=config.get("MAX_IN_FLIGHT"),
+        max_run_seconds=budget.get("max_seconds"),
+        max_rpcs=budget.get("max_rpcs"),
+        max_download_bytes=budget.get("max_bytes"),
+        old_run=old_run,
+        config_file=config_file,
+    )
 
-COLUMNS = ['latitude', 'longitude', 'FIRMS_date', 'image_date', 'date_diff_hours', 'cloud_pct', 'thumbnail_file', 'satellite_image_source', 'detecion_source']
+def ensure_firms_csv(config):
+    """Downloads the FIRMS country CSV when no CSV_PATH was given and it is not on disk yet."""
+    if config.csv_path == firms_csv_path(config.country, config.firms_instrument) and not os.path.exists(config.csv_path):
+        print(f"FIRMS CSV file not found {config.csv_path}, downloading...")
+        download_firms_data(config.country, config.firms_instrument)
 
 
-def filter_by_satellite_start_date(df: pd.DataFrame, satellite: str) -> pd.DataFrame:
+def filter_by_satellite_start_date(df: pd.DataFrame, satellite: str, sort: bool = True, verbose: bool = True) -> pd.DataFrame:
+    """
+    Drops detections older than the start of the satellite mission. With sort=True (default) the
+    result is sorted newest first and reindexed; with sort=False order and index are kept, as
+    needed when filtering chunks of a streamed CSV.
+    """
 
     SATELLITE_START_DATES = {
         "sentinel-2": datetime.datetime(2015, 7, 1),
@@ -83,7 +253,8 @@ def filter_by_satellite_start_date(df: pd.DataFrame, satellite: str) -> pd.DataF
     }
 
     if satellite not in SATELLITE_START_DATES:
-        print(f"Minumum operative date not found for {satellite}, skipping dataframe filtering.")
+        if verbose:
+            print(f"Minumum operative date not found for {satellite}, skipping dataframe filtering.")
         return df.copy()
 
     df_copy = df.copy()
@@ -91,11 +262,14 @@ def filter_by_satellite_start_date(df: pd.DataFrame, satellite: str) -> pd.DataF
 
     min_date = SATELLITE_START_DATES[satellite]
     before_filter = len(df_copy)
-    df_filtered = df_copy[df_copy['acq_date_dt'] >= min_date].reset_index(drop=True)
+    df_filtered = df_copy[df_copy['acq_date_dt'] >= min_date]
     after_filter = len(df_filtered)
-    print(f"{before_filter - after_filter} points previous to {min_date.date()} deleted")
+    if verbose:
+        print(f"{before_filter - after_filter} points previous to {min_date.date()} deleted")
 
     df_filtered = df_filtered.drop(columns=['acq_date_dt'])
+    if not sort:
+        return df_filtered
     df_filtered = df_filtered.sort_values(by=['acq_date', 'acq_time'], ascending=[False, False]).reset_index(drop=True)
     return df_filtered
 
@@ -127,35 +301,89 @@ def clean_firms_df(df: pd.DataFrame, exclude_points: list, radius_km: float=3) -
 
     return clean_df
 
-def download_thumbnail(image, filename, point, satellite, bands=['B4','B3','B2'], size=THUMB_SIZE):
+def cluster_firms_events(df, max_km=3, first_id=0, verbose=True):
+    """
+    Groups detections of the same acquisition (acq_date, acq_time) into fire events with the
+    haversine DBSCAN of metrics.assign_fire_ids. Returns a copy of df with an 'event_id' column,
+    numbered from first_id.
+    """
+    from metrics import cluster_coordinates
+
+    df = df.copy()
+    df['event_id'] = -1
+    next_id = first_id
+
+    for _, acq_df in df.groupby(['acq_date', 'acq_time']):
+        labels = cluster_coordinates(acq_df[['latitude', 'longitude']].to_numpy(), max_km)
+        df.loc[acq_df.index, 'event_id'] = labels + next_id
+        next_id += labels.max() + 1
+
+    if verbose:
+        print(f"{len(df)} detections grouped in {next_id - first_id} fire events")
+    return df
+
+def event_bounds(records, buffer_meters):
+    """(west, south, east, north) of the event detections (detection table records) expanded by buffer_meters."""
+    latitudes, longitudes = records['latitude'], records['longitude']
+    lat_mid = np.radians((latitudes.min() + latitudes.max()) / 2)
+    dlat = buffer_meters / METERS_PER_DEGREE
+    dlon = buffer_meters / (METERS_PER_DEGREE * np.cos(lat_mid))
+    return (
+        float(longitudes.min() - dlon),
+        float(latitudes.min() - dlat),
+        float(longitudes.max() + dlon),
+        float(latitudes.max() + dlat),
+    )
 
-    region = point.buffer(BUFFER_METERS).bounds().getInfo()['coordinates'][0]
+def event_thumb_dimensions(bounds, size):
+    """(width, height) in pixels of an EPSG:4326 thumbnail of bounds whose longest side is size."""
+    west, south, east, north = bounds
+    width_m = (east - west) * METERS_PER_DEGREE * np.cos(np.radians((south + north) / 2))
+    height_m = (north - south) * METERS_PER_DEGREE
+    scale = size / max(width_m, height_m)
+    return max(1, round(width_m * scale)), max(1, round(height_m * scale))
+
+def pixel_positions(latitudes, longitudes, bounds, width, height):
+    """Pixel (x, y) of each coordinate inside an EPSG:4326 thumbnail of bounds."""
+    west, south, east, north = bounds
+    x = np.floor((np.asarray(longitudes) - west) / (east - west) * width).clip(0, width - 1)
+    y = np.floor((north - np.asarray(latitudes)) / (north - south) * height).clip(0, height - 1)
+    return x.astype(int), y.astype(int)
+
+def download_thumbnail(image, filename, point, satellite, bands=['B4','B3','B2'], size=DEFAULT_THUMB_SIZE, buffer_meters=DEFAULT_BUFFER_METERS, budget=None, region=None, crs=None):
+    """
+    Downloads an RGB PNG of the buffer around point. If region (list of lon/lat coordinates)
+    is given it is used as is and point is ignored; size may then be "WIDTHxHEIGHT".
+    """
+    rpcs = 1
+    if region is None:
+        region = point.buffer(buffer_meters).bounds().getInfo()['coordinates'][0]
+        rpcs += 1
 
-    if satellite == "landsat-8":
-        bands = ['SR_B4', 'SR_B3', 'SR_B2']
-        image = image.select(bands).multiply(0.0000275).add(-0.2)
-        vmin, vmax = 0, 0.3
-    elif satellite == "sentinel-2":
-        bands = ['B4', 'B3', 'B2']
-        vmin, vmax = 0, 6000
-    elif satellite == "aqua":
-        bands = ['sur_refl_b01','sur_refl_b04','sur_refl_b03']
-        vmin, vmax = 0, 5000
-    elif satellite == "fengyun":
-        bands = ['Channel0001','Channel0002','Channel0003']
-        vmin, vmax = 0, 4000
-    else:
+    if satellite not in RGB_BANDS:
         raise ValueError(f"Satellite not supported: {satellite}")
 
+    bands = RGB_BANDS[satellite]
+    if satellite in REFLECTANCE_SCALE:
+        gain, offset = REFLECTANCE_SCALE[satellite]
+        image = image.select(bands).multiply(gain).add(offset)
+    vmin, vmax = STRETCH[satellite]
+
+    params = {
+        'dimensions': size, # pixels
+        'region': region, # geografic region
+        'bands': bands,
+        'min': vmin,
+        'max': vmax,
+    }
+    if crs is not None:
+        params['crs'] = crs
+
     try:
-        thumb_url = image.getThumbURL({
-            'dimensions': size, # pixels
-            'region': region, # geografic region
-            'bands': bands,
-            'min': vmin,
-            'max': vmax,
-        })
+        thumb_url = image.getThumbURL(params)
         r = requests.get(thumb_url)
+        if budget is not None:
+            budget.charge(rpcs=rpcs, nbytes=len(r.content))
         if r.status_code == 200:
             with open(filename, 'wb') as f:
                 f.write(r.content)
@@ -166,14 +394,8 @@ def download_thumbnail(image, filename, point, satellite, bands=['B4','B3','B2']
         print(f"Error downloading {filename}: {e}")
     return False
 
-def process_and_download(image, img_info, point, idx, datetime_str, satellite):
-
-    coords = point.coordinates().getInfo()
-    lon = coords[0]
-    lat = coords[1]
-
-    print(f"Processing {idx} ({lat}, {lon}) {datetime_str} {satellite}")
-
+def image_record(img_info, alert_dt):
+    """Image columns of firms_features.csv for a selected image."""
     millis = img_info['properties'].get('system:time_start', None)
     img_date = datetime.datetime.utcfromtimestamp(millis / 1000).isoformat()
 
@@ -182,61 +404,165 @@ def process_and_download(image, img_info, point, idx, datetime_str, satellite):
     except Exception:
         cloud_pct = None
 
-    try:
-        img_filename = os.path.join(OUTPUT_IMG_DIR, f"point_{idx}.png")
-        download_thumbnail(image, img_filename, point, satellite)
-    except Exception as e:
-        print(f"No se pudo descargar miniatura para punto {idx}: {e}")
-        img_filename = None
+    local_cloud_pct = img_info['properties'].get('LOCAL_CLOUD_PCT', None)
+    if local_cloud_pct is not None:
+        local_cloud_pct = round(local_cloud_pct, 2)
 
-    alert_dt = datetime.datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
-
-    if isinstance(img_date, str):
-        img_date_dt = datetime.datetime.fromisoformat(img_date).replace(tzinfo=timezone.utc)
-        date_diff_hours = round((img_date_dt - alert_dt).total_seconds() / 3600, 2)
-    else:
-        print(f"Warning: img_date is None for point {idx}")
-        img_date_dt = None
-        date_diff_hours = None
+    local_valid_pct = img_info['properties'].get('LOCAL_VALID_PCT', None)
+    if local_valid_pct is not None:
+        local_valid_pct = round(local_valid_pct, 2)
 
+    img_date_dt = datetime.datetime.fromisoformat(img_date).replace(tzinfo=timezone.utc)
+    date_diff_hours = round((img_date_dt - alert_dt).total_seconds() / 3600, 2)
 
-    result = {
-        'latitude': lat,
-        'longitude': lon,
-        'FIRMS_date': datetime_str,
+    return {
         'image_date': img_date,
         'date_diff_hours': date_diff_hours,
         'cloud_pct': cloud_pct,
-        'thumbnail_file': os.path.basename(img_filename) if img_filename else None,
-        'satellite_image_source': satellite,
-        'detecion_source': CSV_PATH.split('/')[-1].replace('.csv', '')
+        'local_cloud_pct': local_cloud_pct,
+        'local_valid_pct': local_valid_pct
     }
 
-    pd.DataFrame([result]).to_csv(
-        OUTPUT_CSV,
+def append_results(results, config):
+    pd.DataFrame(results, columns=COLUMNS).to_csv(
+        config.output_csv,
         mode='a',
         header=False,
         index=False
     )
 
-def get_collection(alert_dt, max_dt, point, satellite="sentinel-2"):
+def migrate_output_csv(csv_path):
+    """
+    Rewrites the CSV of a run started with older COLUMNS (or with columns added afterwards, e.g.
+    by thumbnail_quality) so that it starts with the current COLUMNS, the missing ones empty and
+    the extra ones last. The rows of append_results, which have only COLUMNS, then line up with
+    the header, and the extra columns of the new rows read as empty.
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    columns = COLUMNS + [col for col in header if col not in COLUMNS]
+    if header == columns:
+        return
+
+    print(f"Migrating {csv_path} to the current columns (missing: {[col for col in COLUMNS if col not in header]})")
+    df = pd.read_csv(csv_path).reindex(columns=columns)
+    df.to_csv(csv_path + ".tmp", index=False, encoding='utf-8')
+    os.replace(csv_path + ".tmp", csv_path)
+
+def export_image(image, name, region, config, budget=None, dimensions=None, crs=None):
+    """
+    Downloads the thumbnail ({name}.png) and/or the multispectral patch ({name}.npz) of an image
+    according to EXPORT_MODE. Returns the (thumbnail_file, patch_file) names, None if not downloaded.
+    """
+    satellite = config.images_satellite
+    thumbnail_file, patch_file = None, None
+
+    if config.export_mode in ("thumbnail", "both"):
+        thumbnail_file = f"{name}.png"
+        size = dimensions or config.thumb_size
+        if not download_thumbnail(image, os.path.join(config.output_img_dir, thumbnail_file), None, satellite, size=size, budget=budget, region=region, crs=crs):
+            thumbnail_file = None
+
+    if config.export_mode in ("patch", "both"):
+        patch_file = f"{name}.npz"
+        if not download_patch(image, os.path.join(config.output_img_dir, patch_file), satellite, region, config.patch_scale, dimensions, crs, budget):
+            patch_file = None
+
+    return thumbnail_file, patch_file
+
+def point_row(record, img_info, config, thumbnail_file, patch_file=None):
+    """firms_features.csv row of one detection table record and its image."""
+    return {
+        'latitude': float(record['latitude']),
+        'longitude': float(record['longitude']),
+        'FIRMS_date': epoch_to_str(record['epoch']),
+        'thumbnail_file': thumbnail_file,
+        'satellite_image_source': config.images_satellite,
+        'detecion_source': config.detection_source,
+        'patch_file': patch_file,
+        **image_record(img_info, epoch_to_datetime(record['epoch']))
+    }
+
+def process_and_download(image, img_info, record, idx, config, budget=None):
+
+    satellite = config.images_satellite
+
+    lat = float(record['latitude'])
+    lon = float(record['longitude'])
+    datetime_str = epoch_to_str(record['epoch'])
+
+    print(f"Processing {idx} ({lat}, {lon}) {datetime_str} {satellite}")
+
+    try:
+        thumbnail_file, patch_file = export_image(image, f"point_{idx}", region_coordinates(record), config, budget)
+    except Exception as e:
+        print(f"No se pudo descargar miniatura para punto {idx}: {e}")
+        thumbnail_file, patch_file = None, None
+
+    append_results([point_row(record, img_info, config, thumbnail_file, patch_file)], config)
+
+def process_event_image(image, img_info, event_id, name, records, config, budget=None):
+    """
+    Downloads one thumbnail (event_{name}.png) covering the whole event and logs every member
+    detection with its pixel. The event_id column keeps the integer event id.
+    """
+
+    satellite = config.images_satellite
+    datetime_str = epoch_to_str(records[0]['epoch'])
+
+    print(f"Processing event {name} ({len(records)} detections) {datetime_str} {satellite}")
+
+    bounds = event_bounds(records, config.buffer_meters)
+    west, south, east, north = bounds
+    width, height = event_thumb_dimensions(bounds, config.thumb_size)
+
+    # The patch uses the thumbnail grid so that pixel_x / pixel_y are valid for both
+    region = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+    thumbnail_file, patch_file = export_image(image, f"event_{name}", region, config, budget, f"{width}x{height}", 'EPSG:4326')
+
+    image_columns = image_record(img_info, epoch_to_datetime(records[0]['epoch']))
+
+    pixel_x, pixel_y = pixel_positions(records['latitude'], records['longitude'], bounds, width, height)
+
+    results = [{
+        'latitude': float(lat),
+        'longitude': float(lon),
+        'FIRMS_date': datetime_str,
+        'thumbnail_file': thumbnail_file,
+        'satellite_image_source': satellite,
+        'detecion_source': config.detection_source,
+        'patch_file': patch_file,
+        'event_id': int(event_id),
+        'pixel_x': x,
+        'pixel_y': y,
+        **image_columns
+    } for lat, lon, x, y in zip(records['latitude'], records['longitude'], pixel_x, pixel_y)]
+
+    append_results(results, config)
+
+def get_collection(alert_dt, max_dt, point, satellite="sentinel-2", cloud_filter_percentage=85):
+    import ee
 
     if satellite == "sentinel-2":
         collection_string = "COPERNICUS/S2_SR_HARMONIZED"
         cloud_property = "CLOUDY_PIXEL_PERCENTAGE"
-        cloud_filter = ee.Filter.lt(cloud_property, CLOUD_FILTER_PERCENTAGE)
     elif satellite == "landsat-8":
         collection_string = "LANDSAT/LC08/C02/T1_L2"
-        cloud_filter = ee.Filter.lt('CLOUD_COVER', CLOUD_FILTER_PERCENTAGE)
+        cloud_property = "CLOUD_COVER"
     elif satellite == "aqua":
         collection_string = "MODIS/061/MYD09GA"
-        cloud_filter = None
+        cloud_property = None
     elif satellite == "fengyun":
         collection_string = "CMA/FY4A/AGRI/L1"
-        cloud_filter = None
+        cloud_property = None
     else:
         raise ValueError(f"Satellite not supported: {satellite}")
 
+    # cloud_filter_percentage=None disables the scene-level filter
+    if cloud_property and cloud_filter_percentage is not None:
+        cloud_filter = ee.Filter.lt(cloud_property, cloud_filter_percentage)
+    else:
+        cloud_filter = None
+
     collection = ee.ImageCollection(collection_string).filterBounds(point).filterDate(alert_dt, max_dt)
 
     if collection.size().eq(0).getInfo():
@@ -249,18 +575,101 @@ def get_collection(alert_dt, max_dt, point, satellite="sentinel-2"):
 
     return collection
 
-def check_valid_image(img_info, satellite):
-
+def local_cloud_masks(image, satellite):
+    """
+    Returns (cloudy, valid) 0/1 images built from the pixel QA band of the satellite:
+    SCL/QA60 for Sentinel-2, QA_PIXEL for Landsat-8 and state_1km for Aqua.
+    """
     if satellite == "sentinel-2":
-        required_bands = ['B8','B4','B3','B12']
+        scl = image.select('SCL')
+        qa60 = image.select('QA60').unmask(0)
+        # SCL 3: cloud shadow, 8/9: medium/high probability cloud, 10: cirrus. QA60 bits 10/11: opaque/cirrus
+        cloudy = scl.eq(3).Or(scl.eq(8)).Or(scl.eq(9)).Or(scl.eq(10))
+        cloudy = cloudy.Or(qa60.bitwiseAnd((1 << 10) | (1 << 11)).neq(0))
+        valid = scl.neq(0)
     elif satellite == "landsat-8":
-        required_bands = ['SR_B5', 'SR_B4', 'SR_B3', 'SR_B7']
+        qa = image.select('QA_PIXEL')
+        # Bit 0: fill. Bits 1-4: dilated cloud, cirrus, cloud, cloud shadow
+        cloudy = qa.bitwiseAnd(0b11110).neq(0)
+        valid = qa.bitwiseAnd(1).eq(0)
     elif satellite == "aqua":
-        required_bands = ['sur_refl_b01', 'sur_refl_b02', 'sur_refl_b07']
-    elif satellite == "fengyun":
-        required_bands = ['Channel0001', 'Channel0002', 'Channel0003']
+        state = image.select('state_1km')
+        # Bits 0-1: cloud state (1 cloudy, 2 mixed). Bit 2: cloud shadow
+        cloud_state = state.bitwiseAnd(0b11)
+        cloudy = cloud_state.eq(1).Or(cloud_state.eq(2)).Or(state.bitwiseAnd(0b100).neq(0))
+        valid = state.mask()
     else:
+        raise ValueError(f"Local cloud masks not supported for: {satellite}")
+
+    valid = valid.unmask(0)
+    cloudy = cloudy.unmask(0).And(valid)
+    return cloudy, valid
+
+def rank_by_local_cloud(collection, region, alert_dt, config):
+    """
+    Annotates each image with LOCAL_CLOUD_PCT / LOCAL_VALID_PCT measured inside region
+    and sorts the collection by a score combining time difference and local cloud.
+    Everything is evaluated server side, in the same request that fetches the images.
+    """
+    import ee
+
+    satellite = config.images_satellite
+    alert_millis = int(alert_dt.timestamp() * 1000)
+    weight = config.cloud_score_weight
+
+    def add_local_cloud_stats(image):
+        cloudy, valid = local_cloud_masks(image, satellite)
+        stats = ee.Image.cat([cloudy.rename('cloudy'), valid.rename('valid')]).reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=region,
+            scale=LOCAL_CLOUD_SCALES[satellite],
+            maxPixels=1e8
+        )
+        valid_frac = ee.Number(stats.get('valid'))
+        cloud_pct = ee.Number(ee.Algorithms.If(
+            valid_frac.gt(0),
+            ee.Number(stats.get('cloudy')).divide(valid_frac).multiply(100),
+            100
+        ))
+        hours = ee.Number(image.get('system:time_start')).subtract(alert_millis).abs().divide(3600 * 1000)
+        score = hours.divide(config.max_time_diff_hours).multiply(1 - weight).add(cloud_pct.divide(100).multiply(weight))
+        return image.set({
+            'LOCAL_CLOUD_PCT': cloud_pct,
+            'LOCAL_VALID_PCT': valid_frac.multiply(100),
+            'SELECTION_SCORE': score
+        })
+
+    collection = collection.map(add_local_cloud_stats)
+
+    if config.cloud_filter_percentage is not None:
+        collection = collection.filter(ee.Filter.lt('LOCAL_CLOUD_PCT', config.cloud_filter_percentage))
+
+    return collection.sort('SELECTION_SCORE')
+
+def add_valid_pixel_stats(collection, region, satellite):
+    """
+    Annotates each image with LOCAL_VALID_PCT, the percentage of the region where all the
+    RGB thumbnail bands have data (swath and tile edges are masked). Evaluated server side.
+    """
+    import ee
+
+    def add_stats(image):
+        valid = image.select(RGB_BANDS[satellite]).mask().reduce(ee.Reducer.min()).unmask(0)
+        stats = valid.rename('valid').reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=region,
+            scale=NATIVE_SCALES[satellite],
+            maxPixels=1e8
+        )
+        return image.set('LOCAL_VALID_PCT', ee.Number(stats.get('valid')).multiply(100))
+
+    return collection.map(add_stats)
+
+def check_valid_image(img_info, satellite):
+
+    if satellite not in REQUIRED_BANDS:
         raise ValueError(f"Satélite no soportado: {satellite}")
+    required_bands = REQUIRED_BANDS[satellite]
     
     if img_info is None or 'bands' not in img_info:
         return False
@@ -272,86 +681,725 @@ def check_valid_image(img_info, satellite):
     
     return True
         
-def process_single_point(idx, row, images_satellite, max_images_per_point):
-    lat, lon = row['latitude'], row['longitude']
+def candidate_collection(geometry, region, record, config, budget=None):
+    """
+    Images intersecting geometry within the time window of a detection table record, in selection
+    order (ranked by cloud inside region in local_cloud mode, and without the images whose
+    valid-pixel percentage inside region is below MIN_VALID_PCT). None if the window is empty.
+    """
+    import ee
 
-    date_str = row['acq_date']
-    time_str = str(row['acq_time']).zfill(4)
+    images_satellite = config.images_satellite
 
-    point = ee.Geometry.Point(lon, lat)
-    time_formatted = f"{time_str[:2]}:{time_str[2:]}:00"
-    datetime_str = f"{date_str}T{time_formatted}"
+    min_dt = epoch_to_datetime(record['window_start'])
+    max_dt = epoch_to_datetime(record['window_end'])
 
-    alert_dt = datetime.datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
-    min_dt = alert_dt - datetime.timedelta(hours=MAX_TIME_DIFF_HOURS)
-    max_dt = alert_dt + datetime.timedelta(hours=MAX_TIME_DIFF_HOURS)
+    local_cloud = config.selection_mode == "local_cloud"
 
-    try:
-        collection = get_collection(min_dt, max_dt, point, images_satellite)
+    # In local_cloud mode CLOUD_FILTER_PERCENTAGE applies to the buffer instead of the scene
+    scene_cloud_filter = None if local_cloud else config.cloud_filter_percentage
+    collection = get_collection(min_dt, max_dt, geometry, images_satellite, scene_cloud_filter)
+    if budget is not None:
+        budget.charge(rpcs=1)
 
-        if collection is None:
-            return
+    if collection is None:
+        return None
+
+    if local_cloud:
+        collection = rank_by_local_cloud(collection, region, epoch_to_datetime(record['epoch']), config)
+
+    # Images mostly outside the swath / tile are dropped in the same request, before any download
+    if config.min_valid_pct is not None:
+        if not local_cloud:
+            collection = add_valid_pixel_stats(collection, region, images_satellite)
+        collection = collection.filter(ee.Filter.gte('LOCAL_VALID_PCT', config.min_valid_pct))
+
+    return collection
+
+def select_images(geometry, region, record, config, budget=None, label=""):
+    """
+    Searches the candidate images of a detection table record (see candidate_collection).
+    Returns (n_images, [(i, image, img_info), ...]) with the images that have the required bands.
+    """
+    import ee
+
+    images_satellite = config.images_satellite
+    max_images_per_point = config.max_images_per_point
+
+    collection = candidate_collection(geometry, region, record, config, budget)
+    if collection is None:
+        return 0, []
+
+    images_list = collection.toList(max_images_per_point)
+    n_images = min(images_list.size().getInfo(), max_images_per_point)
+    if budget is not None:
+        budget.charge(rpcs=1)
+
+    selected = []
+    for i in range(n_images):
+        try:
+            image = ee.Image(images_list.get(i))
+            img_info = image.getInfo()
+            if budget is not None:
+                budget.charge(rpcs=1)
+            if check_valid_image(img_info, images_satellite):
+                selected.append((i, image, img_info))
+        except Exception as e:
+            print(f"Error processing image {i+1} for {label}: {e}")
+
+    return n_images, selected
+
+def process_single_point(position, table, config, budget=None):
+    """
+    Processes the detection at `position` of the detection table.
+    """
+    import ee
+
+    record = table[position]
+    idx = int(record['det_id'])
 
-        images_list = collection.toList(max_images_per_point)
-        n_images = min(images_list.size().getInfo(), max_images_per_point)
+    point = ee.Geometry.Point(float(record['longitude']), float(record['latitude']))
 
-        for i in range(n_images):
+    try:
+        n_images, selected = select_images(point, point.buffer(config.buffer_meters), record, config, budget, f"point {idx}")
+
+        for i, image, img_info in selected:
             try:
-                image = ee.Image(images_list.get(i))
-                img_info = image.getInfo()
-                if check_valid_image(img_info, images_satellite):
-                    im_idx = f"{idx}_{i+1}" if n_images > 1 else str(idx)
-                    process_and_download(image, img_info, point, im_idx, datetime_str, images_satellite)
+                im_idx = f"{idx}_{i+1}" if n_images > 1 else str(idx)
+                process_and_download(image, img_info, record, im_idx, config, budget)
             except Exception as e:
                 print(f"Error processing image {i+1} for point {idx}: {e}")
 
     except Exception as e:
         print(f"Error processing point {idx}: {e}")
 
+    return True
 
-def process_data(detected_coordinates_df, images_satellite, max_images_per_point, num_threads=NUM_THREADS):
-    if not os.path.exists(OUTPUT_CSV):
-        with open(OUTPUT_CSV, 'w', newline='', encoding='utf-8') as f:
-            pd.DataFrame(columns=COLUMNS).to_csv(f, index=False)
+def process_single_event(event_id, positions, table, config, budget=None):
+    """
+    Processes all the detections of one fire event (their positions in the detection table)
+    with a single search and one thumbnail per selected image.
+    """
+    import ee
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-        list(
-            tqdm(
-                executor.map(
-                    lambda args: process_single_point(*args),
-                    [(idx, row, images_satellite, max_images_per_point) for idx, row in detected_coordinates_df.iterrows()]
-                ),
-                total=len(detected_coordinates_df),
+    records = table[positions]
+
+    try:
+        region = ee.Geometry.Rectangle(list(event_bounds(records, config.buffer_meters)))
+        n_images, selected = select_images(region, region, records[0], config, budget, f"event {event_id}")
+
+        for i, image, img_info in selected:
+            try:
+                name = f"{event_id}_{i+1}" if n_images > 1 else str(event_id)
+                process_event_image(image, img_info, event_id, name, records, config, budget)
+            except Exception as e:
+                print(f"Error processing image {i+1} for event {event_id}: {e}")
+
+    except Exception as e:
+        print(f"Error processing event {event_id}: {e}")
+
+    return True
+
+def frame_metadata(frames, budget=None):
+    """
+    img_info-like dicts (id, bands, FRAME_PROPERTIES) of every image of a collection,
+    fetched in a single request.
+    """
+    import ee
+
+    def image_info(image):
+        image = ee.Image(image)
+        return ee.Dictionary({
+            'id': image.id(),
+            'bands': image.bandNames(),
+            'properties': ee.Dictionary.fromLists(FRAME_PROPERTIES, [image.get(p) for p in FRAME_PROPERTIES])
+        })
+
+    infos = frames.toList(frames.size()).map(image_info).getInfo()
+    if budget is not None:
+        budget.charge(rpcs=1)
+
+    for info in infos:
+        info['bands'] = [{'id': b} for b in info['bands']]
+    return infos
+
+def download_filmstrip(frames, filenames, satellite, size, region, budget=None):
+    """
+    Downloads the RGB thumbnails of all the images of a collection as one filmstrip
+    (frames stacked vertically, in collection order) and saves each frame to its filename.
+    Returns the filenames written.
+    """
+    from PIL import Image
+
+    bands = RGB_BANDS[satellite]
+    frames = frames.select(bands)
+    if satellite in REFLECTANCE_SCALE:
+        gain, offset = REFLECTANCE_SCALE[satellite]
+        frames = frames.map(lambda image: image.multiply(gain).add(offset))
+    vmin, vmax = STRETCH[satellite]
+
+    params = {
+        'dimensions': size,
+        'region': region,
+        'bands': bands,
+        'min': vmin,
+        'max': vmax,
+        'format': 'png',
+    }
+
+    try:
+        r = requests.get(frames.getFilmstripThumbURL(params))
+        if budget is not None:
+            budget.charge(rpcs=1, nbytes=len(r.content))
+        if r.status_code != 200:
+            print(f"Error HTTP {r.status_code} downloading filmstrip of {filenames[0]}")
+            return []
+
+        with Image.open(io.BytesIO(r.content)) as strip:
+            strip = strip.convert('RGBA')
+            frame_height = strip.height // len(filenames)
+            for i, filename in enumerate(filenames):
+                strip.crop((0, i * frame_height, strip.width, (i + 1) * frame_height)).save(filename)
+        return list(filenames)
+    except Exception as e:
+        print(f"Error downloading filmstrip of {filenames[0]}: {e}")
+    return []
+
+def process_single_stack(position, table, config, budget=None):
+    """
+    Processes the detection at `position` of the detection table in "stack" mode: up to
+    MAX_IMAGES_PER_POINT frames with the required bands, their metadata in one request and
+    their thumbnails in one filmstrip, so the requests per detection do not grow with the frames.
+    """
+    import ee
+
+    record = table[position]
+    idx = int(record['det_id'])
+    satellite = config.images_satellite
+
+    point = ee.Geometry.Point(float(record['longitude']), float(record['latitude']))
+
+    try:
+        collection = candidate_collection(point, point.buffer(config.buffer_meters), record, config, budget)
+        if collection is None:
+            return True
+
+        has_bands = [ee.Filter.listContains('system:band_names', b) for b in REQUIRED_BANDS[satellite]]
+        # Frames in time order (local_cloud ranks by score), so point_X_1..N follow the sequence
+        frames = collection.filter(ee.Filter.And(*has_bands)).limit(config.max_images_per_point).sort('system:time_start')
+        frames_info = frame_metadata(frames, budget)
+        if not frames_info:
+            return True
+
+        print(f"Processing {idx} ({len(frames_info)} frames) {epoch_to_str(record['epoch'])} {satellite}")
+
+        names = [f"point_{idx}_{i+1}.png" if len(frames_info) > 1 else f"point_{idx}.png" for i in range(len(frames_info))]
+        written = download_filmstrip(
+            frames,
+            [os.path.join(config.output_img_dir, name) for name in names],
+            satellite,
+            config.thumb_size,
+            region_coordinates(record),
+            budget
+        )
+
+        append_results([
+            point_row(record, img_info, config, name if os.path.join(config.output_img_dir, name) in written else None)
+            for name, img_info in zip(names, frames_info)
+        ], config)
+
+    except Exception as e:
+        print(f"Error processing point {idx}: {e}")
+
+    return True
+
+def list_images(geometry, min_dt, max_dt, satellite, budget=None):
+    """
+    Ids, start times (ms) and band names of the images intersecting geometry in the
+    time window, sorted by time and fetched in a single request. None if there are none.
+    """
+    import ee
+
+    collection = get_collection(min_dt, max_dt, geometry, satellite, None)
+    if budget is not None:
+        budget.charge(rpcs=1)
+
+    if collection is None:
+        return None
+
+    collection = collection.map(lambda image: image.set({'image_id': image.id(), 'band_names': image.bandNames()}))
+    info = ee.Dictionary({
+        'ids': collection.aggregate_array('image_id'),
+        'times': collection.aggregate_array('system:time_start'),
+        'bands': collection.aggregate_array('band_names'),
+    }).getInfo()
+    if budget is not None:
+        budget.charge(rpcs=1)
+
+    return info
+
+def resolve_images(records, times, max_images):
+    """
+    Same choice as select_images in earliest mode, made locally: for each record, the
+    position (in the sorted times) of the first image of its time window and how many to take.
+    """
+    times = np.asarray(times, dtype='i8')
+    first = np.searchsorted(times, records['window_start'] * 1000, side='left')
+    end = np.searchsorted(times, records['window_end'] * 1000, side='left')
+    return first, np.minimum(end - first, max_images)
+
+def download_mosaic_crops(image, records, names, pixel_meters, config, crop_executor, budget=None):
+    """
+    Downloads the region of image covering the buffers of records once, in EPSG:4326 tiles of
+    pixel_meters, and cuts point_{name}.png crops locally in worker processes. Regions above
+    MOSAIC_MAX_PIXELS are not downloaded. Returns the filenames written.
+    """
+    from PIL import Image
+
+    satellite = config.images_satellite
+    bounds = (records['west'].min(), records['south'].min(), records['east'].max(), records['north'].max())
+    mosaic_bounds, width, height = mosaic_grid(bounds, pixel_meters)
+
+    if width * height > MOSAIC_MAX_PIXELS:
+        print(f"Mosaic of {len(records)} detections is {width}x{height} px, above MOSAIC_MAX_PIXELS, skipped")
+        return set()
+
+    written = set()
+    with tempfile.TemporaryDirectory(dir=config.output_img_dir) as tmp_dir:
+        mosaic = np.zeros((height, width, 4), dtype='u1')
+        tile_path = os.path.join(tmp_dir, "tile.png")
+        for x0, y0, w, h, (west, south, east, north) in mosaic_tiles(mosaic_bounds, width, height):
+            region = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+            if not download_thumbnail(image, tile_path, None, satellite, size=f"{w}x{h}", budget=budget, region=region, crs='EPSG:4326'):
+                return written
+            with Image.open(tile_path) as tile:
+                mosaic[y0:y0 + h, x0:x0 + w] = np.asarray(tile.convert('RGBA'))
+
+        mosaic_path = os.path.join(tmp_dir, "mosaic.npy")
+        np.save(mosaic_path, mosaic)
+        del mosaic
+
+        crops = [
+            (
+                os.path.join(config.output_img_dir, f"point_{name}.png"),
+                (record['west'], record['south'], record['east'], record['north']),
+                event_thumb_dimensions((record['west'], record['south'], record['east'], record['north']), config.thumb_size)
             )
+            for name, record in zip(names, records)
+        ]
+        futures = [
+            crop_executor.submit(crop_mosaic, mosaic_path, mosaic_bounds, crops[i:i + CROP_BATCH])
+            for i in range(0, len(crops), CROP_BATCH)
+        ]
+        for future in futures:
+            written.update(future.result())
+    return written
+
+def process_mosaic_image(image, img_info, records, names, config, crop_executor, budget=None):
+    """
+    Downloads image around its records at the coarsest of the native and the thumbnail
+    resolution, one region per cell of about MOSAIC_TILE_PX pixels with detections (see
+    mosaic_cells), so empty areas between distant detections are not fetched, and logs a
+    point_{name}.png crop per record (see download_mosaic_crops).
+    """
+    satellite = config.images_satellite
+    pixel_meters = max(NATIVE_SCALES[satellite], 2 * config.buffer_meters / config.thumb_size)
+    rows, cols = mosaic_cells(records['latitude'], records['longitude'], pixel_meters)
+    cells = pd.Series(np.arange(len(records))).groupby([rows, cols]).indices
+
+    print(f"Processing mosaic {img_info['id']} ({len(records)} detections in {len(cells)} cells) {satellite}")
+
+    written = set()
+    for positions in cells.values():
+        written |= download_mosaic_crops(image, records[positions], [names[p] for p in positions], pixel_meters, config, crop_executor, budget)
+
+    results = []
+    for name, record in zip(names, records):
+        filename = os.path.join(config.output_img_dir, f"point_{name}.png")
+        results.append(point_row(record, img_info, config, os.path.basename(filename) if filename in written else None))
+    append_results(results, config)
+
+def process_mosaic_group(positions, table, config, crop_executor, budget=None):
+    """
+    Processes a group of detections (their positions in the detection table) with a single
+    image search. Detections are grouped by resolved image and each image is downloaded once
+    (see process_mosaic_image).
+    """
+    import ee
+
+    records = table[positions]
+    label = f"group of {len(records)} detections from {epoch_to_str(records['epoch'].min())}"
+
+    try:
+        region = ee.Geometry.Rectangle([
+            float(records['west'].min()), float(records['south'].min()),
+            float(records['east'].max()), float(records['north'].max())
+        ])
+        info = list_images(
+            region,
+            epoch_to_datetime(records['window_start'].min()),
+            epoch_to_datetime(records['window_end'].max()),
+            config.images_satellite,
+            budget
         )
+        if info is None:
+            return True
 
+        first, n_images = resolve_images(records, info['times'], config.max_images_per_point)
+
+        # image position -> (record positions, output names) of the detections that use it
+        members = {}
+        for p in range(len(records)):
+            idx = int(records[p]['det_id'])
+            for i in range(n_images[p]):
+                record_positions, names = members.setdefault(first[p] + i, ([], []))
+                record_positions.append(p)
+                names.append(f"{idx}_{i+1}" if n_images[p] > 1 else str(idx))
+
+        for image_pos, (record_positions, names) in members.items():
+            img_info = {
+                'id': info['ids'][image_pos],
+                'bands': [{'id': b} for b in info['bands'][image_pos]],
+                'properties': {'system:time_start': info['times'][image_pos]}
+            }
+            if not check_valid_image(img_info, config.images_satellite):
+                continue
+            try:
+                process_mosaic_image(ee.Image(img_info['id']), img_info, records[record_positions], names, config, crop_executor, budget)
+            except Exception as e:
+                print(f"Error processing mosaic {img_info['id']} for {label}: {e}")
 
+    except Exception as e:
+        print(f"Error processing {label}: {e}")
 
-if __name__ == "__main__":
+    return True
 
-    ee.Initialize(project=GEE_PROJECT)
 
-    os.makedirs(OUTPUT_IMG_DIR, exist_ok=True)
+def count_csv_rows(csv_path):
+    """Number of data rows of a CSV, counting newlines in binary blocks."""
+    with open(csv_path, 'rb') as f:
+        lines = sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+    return max(lines - 1, 0)
 
-    print(f"Number of threads: {NUM_THREADS}")
-    print("Starting image collection...")
-    print(f"Input FIRMS dataset: {CSV_PATH}")
+def last_exported_idx(old_run):
+    """
+    det_id of the last detection of a previous run that produced a file (point_{idx}[_N].png, or
+    the .npz patch when no thumbnail is written), None if there is none. Rows of failed
+    downloads have no file name and are skipped.
+    """
+    df = pd.read_csv(f'{old_run}/firms_features.csv', usecols=lambda col: col in ('thumbnail_file', 'patch_file'))
+    files = df['thumbnail_file']
+    if 'patch_file' in df.columns:
+        files = files.fillna(df['patch_file'])
+    files = files.dropna()
+    if files.empty:
+        return None
+    return int(os.path.splitext(files.iloc[-1])[0].split('_')[1])
 
-    firms_data = pd.read_csv(CSV_PATH)
-    firms_data = filter_by_satellite_start_date(firms_data, IMAGES_SATELLITE)
+def done_event_ids(old_run):
+    """
+    Event ids already logged by a previous run. Runs made before the event_id column kept the
+    integer id logged the file suffix ("12_1"), the id is read from its first part.
+    """
+    event_ids = pd.read_csv(f'{old_run}/firms_features.csv', usecols=['event_id'], dtype={'event_id': str})['event_id'].dropna()
+    return set(pd.to_numeric(event_ids.str.split('_').str[0], errors='coerce').dropna().astype(int))
 
-    if old_run:
-        last_image = pd.read_csv(f'{old_run}/firms_features.csv').iloc[-1]['thumbnail_file'].split('_')[1].replace('.png','')
-        print(f"Resuming from image {last_image}...")
-        firms_data = firms_data.iloc[int(last_image)+1:]
+def detection_keys(df):
+    """(latitude, longitude, epoch) of raw FIRMS rows or firms_features.csv rows, as a MultiIndex."""
+    return pd.MultiIndex.from_arrays([df['latitude'].to_numpy(), df['longitude'].to_numpy(), firms_epochs(df)])
+
+def read_input_detections(config):
+    """(number of rows, detections after the start date filter in file order) of the input CSV."""
+    df = pd.read_csv(config.csv_path)
+    return len(df), filter_by_satellite_start_date(df, config.images_satellite, sort=False, verbose=False)
+
+def save_input_keys(config, keys=None, next_id=None):
+    """
+    Records the detections of the input of the run in {output_img_dir}/input_keys.npz (see
+    queue_input_changes). By default every det_id / event_id below the number of input rows
+    is taken, which covers both the in-memory and the chunked numbering.
+    """
+    if keys is None:
+        next_id, df = read_input_detections(config)
+        keys = detection_keys(df)
+
+    np.savez_compressed(
+        os.path.join(config.output_img_dir, INPUT_KEYS_FILE),
+        latitude=keys.get_level_values(0).to_numpy(),
+        longitude=keys.get_level_values(1).to_numpy(),
+        epoch=keys.get_level_values(2).to_numpy(),
+        next_id=next_id
+    )
+
+def queue_input_changes(config):
+    """
+    Brings the run in output_img_dir up to date with a changed input CSV, matching detections by
+    coordinates and acquisition time (see INPUT_KEYS_FILE) instead of by position. Rows of
+    detections no longer in the input are dropped from firms_features.csv and pending.csv, and
+    the new detections are appended to pending.csv, in PRIORITY order and numbered after every
+    det_id / event_id used so far, so that resuming the run (OLD_RUN_DIR) only processes them.
+    New detections are clustered into events among themselves. Returns the pending detections.
+    """
+    run_dir = config.output_img_dir
+    with np.load(os.path.join(run_dir, INPUT_KEYS_FILE)) as saved:
+        old_keys = pd.MultiIndex.from_arrays([saved['latitude'], saved['longitude'], saved['epoch']])
+        next_id = int(saved['next_id'])
+
+    _, df = read_input_detections(config)
+    keys = detection_keys(df)
+
+    features = pd.read_csv(config.output_csv)
+    kept = detection_keys(features).isin(keys)
+    if not kept.all():
+        features[kept].to_csv(config.output_csv + ".tmp", index=False)
+        os.replace(config.output_csv + ".tmp", config.output_csv)
+
+    pending_path = os.path.join(run_dir, PENDING_FILE)
+    parts = []
+    if os.path.exists(pending_path):
+        pending = pd.read_csv(pending_path, index_col=0)
+        # det_id from next_id on were queued by an interrupted call and are queued again below
+        parts.append(pending[(pending.index < next_id) & detection_keys(pending).isin(keys)])
+
+    new = filter_by_satellite_start_date(df[~keys.isin(old_keys)], config.images_satellite, verbose=False)
+    if config.collection_mode == "event" and len(new) > 0:
+        new = cluster_firms_events(new, config.event_max_km, next_id, verbose=False)
+    new = prioritize(new, config.priority)
+    new.index = pd.RangeIndex(next_id, next_id + len(new))
+    parts.append(new)
+
+    pending = pd.concat(parts)
+    print(f"Input of {run_dir} changed: {len(features) - kept.sum()} rows of removed detections dropped, {len(new)} new detections queued")
+    if len(pending) > 0:
+        pending.to_csv(pending_path + ".tmp")
+        os.replace(pending_path + ".tmp", pending_path)
+    elif os.path.exists(pending_path):
+        os.remove(pending_path)
+
+    save_input_keys(config, keys, next_id + len(new))
+    return len(pending)
+
+def stream_detections(csv_path, config, from_pending=False, resume_after=None, done_events=None):
+    """
+    Reads the FIRMS CSV lazily, CHUNK_SIZE rows at a time and in file order, and yields
+    (rows_read, chunk) ready for process_data: start date filter, events numbered across chunks
+    in event mode and detections already processed by a resumed run dropped. The index of each
+    chunk is the row number in the file (or the saved index when reading pending.csv).
+    """
+    reader = pd.read_csv(csv_path, chunksize=config.chunk_size, index_col=0 if from_pending else None)
+    next_event_id = 0
+
+    for chunk in reader:
+        rows_read = len(chunk)
+
+        if not from_pending:
+            chunk = filter_by_satellite_start_date(chunk, config.images_satellite, sort=False, verbose=False)
+            if resume_after is not None:
+                chunk = chunk[chunk.index > resume_after]
+            if config.collection_mode == "event" and len(chunk) > 0:
+                chunk = cluster_firms_events(chunk, config.event_max_km, next_event_id, verbose=False)
+                next_event_id = chunk['event_id'].max() + 1
+                if done_events is not None:
+                    chunk = chunk[~chunk['event_id'].isin(done_events)]
+
+        yield rows_read, chunk
+
+def detection_tasks(chunk, config, budget=None, crop_executor=None):
+    """
+    (func, args, key) tasks for the detections of one chunk; key is (chunk, table positions).
+    func returns False, without doing anything, once the budget is exhausted.
+    """
+    table = detection_table_from_df(chunk, config.max_time_diff_hours, config.buffer_meters)
+
+    if config.collection_mode == "mosaic":
+        process = unless_exhausted(process_mosaic_group, budget)
+        group_ids = table['epoch'] // (MOSAIC_GROUP_DAYS * 24 * 3600)
+        group_positions = pd.Series(np.arange(len(table))).groupby(group_ids, sort=False).indices
+        for group_id in pd.unique(group_ids):
+            positions = group_positions[group_id]
+            yield process, (positions, table, config, crop_executor, budget), (chunk, positions)
+    elif config.collection_mode == "event":
+        process = unless_exhausted(process_single_event, budget)
+        event_ids = chunk['event_id'].to_numpy()
+        event_positions = pd.Series(np.arange(len(table))).groupby(event_ids, sort=False).indices
+        for event_id in pd.unique(event_ids):
+            positions = event_positions[event_id]
+            yield process, (event_id, positions, table, config, budget), (chunk, positions)
+    else:
+        process = unless_exhausted(process_single_stack if config.collection_mode == "stack" else process_single_point, budget)
+        for position in range(len(table)):
+            yield process, (position, table, config, budget), (chunk, [position])
+
+def append_pending(rows, pending_path):
+    rows.to_csv(pending_path, mode='a', header=not os.path.exists(pending_path))
+
+def process_data(detections, config, budget=None, pending_path=None, total=None):
+    """
+    Processes detections given as a DataFrame or as an iterable of (rows_read, chunk) pairs
+    (see stream_detections), in order. Chunks are converted into detection tables (see
+    detection_table.py) only when their turn comes, and at most MAX_IN_FLIGHT tasks are
+    submitted at a time, so memory does not depend on the input size.
+
+    When the budget runs out the remaining detections are skipped and appended to
+    pending_path. Returns the number of pending detections.
+    """
+    if not os.path.exists(config.output_csv):
+        with open(config.output_csv, 'w', newline='', encoding='utf-8') as f:
+            pd.DataFrame(columns=COLUMNS).to_csv(f, index=False)
     else:
-        config_dest_path = os.path.join(OUTPUT_IMG_DIR, "config.json")
-        shutil.copy(CONFG_FILE_NAME, config_dest_path)
+        migrate_output_csv(config.output_csv)
 
-    print(f"{len(firms_data)} points loaded from {CSV_PATH}")
+    if isinstance(detections, pd.DataFrame):
+        total = len(detections)
+        detections = [(len(detections), detections)]
 
-    process_data(firms_data, IMAGES_SATELLITE, MAX_IMAGES_PER_POINT)
+    max_in_flight = config.max_in_flight or config.num_threads * 4
+    n_pending = 0
+
+    def skip(rows):
+        nonlocal n_pending
+        n_pending += len(rows)
+        if pending_path is not None and len(rows) > 0:
+            append_pending(rows, pending_path)
+
+    # Crops of "mosaic" mode are cut in worker processes (spawned: the pool is used from threads)
+    if config.collection_mode == "mosaic":
+        crop_pool = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+    else:
+        crop_pool = contextlib.nullcontext()
+
+    with tqdm(total=total) as progress, crop_pool as crop_executor:
+
+        def tasks():
+            for rows_read, chunk in detections:
+                # rows dropped by the chunk filters count as done
+                progress.update(rows_read - len(chunk))
+                if budget is not None and budget.exhausted():
+                    skip(chunk)
+                    progress.update(len(chunk))
+                    continue
+
+                chunk_tasks = detection_tasks(chunk, config, budget, crop_executor)
+                for task in chunk_tasks:
+                    if budget is not None and budget.exhausted():
+                        # the rest of the chunk goes to pending in one write
+                        positions = np.concatenate([task[2][1]] + [rest[2][1] for rest in chunk_tasks])
+                        skip(chunk.iloc[positions])
+                        progress.update(len(positions))
+                        break
+                    yield task
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=config.num_threads) as executor:
+            for (chunk, positions), done in bounded_map(executor, tasks(), max_in_flight):
+                if not done:
+                    skip(chunk.iloc[positions])
+                progress.update(len(positions))
+
+    return n_pending
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download satellite thumbnails for FIRMS detections.")
+    parser.add_argument("--config", default=CONFG_FILE_NAME, help="JSON config file (see config/collect_images_config_example.json).")
+    parser.add_argument("--plan", action="store_true", help="Only estimate RPCs, downloads, bytes and time of the run, without Earth Engine calls.")
+    return parser.parse_args(argv)
+
+def run_collection(config):
+    """Runs (or resumes) the collection described by a CollectConfig."""
+    import ee
+
+    ensure_firms_csv(config)
+
+    ee.Initialize(project=config.gee_project)
+
+    os.makedirs(config.output_img_dir, exist_ok=True)
+
+    print(f"Number of threads: {config.num_threads}")
+    print("Starting image collection...")
+    print(f"Input FIRMS dataset: {config.csv_path}")
+
+    pending_path = os.path.join(config.output_img_dir, PENDING_FILE)
+    resume_from_pending = bool(config.old_run) and os.path.exists(pending_path)
+
+    if resume_from_pending:
+        print(f"Resuming pending detections from {pending_path}...")
+    elif not config.old_run:
+        config_dest_path = os.path.join(config.output_img_dir, "config.json")
+        shutil.copy(config.config_file, config_dest_path)
+
+    if config.chunk_size:
+        source_path = pending_path if resume_from_pending else config.csv_path
+        resume_after, done_events = None, None
+
+        if config.old_run and not resume_from_pending:
+            if config.collection_mode == "event":
+                done_events = done_event_ids(config.old_run)
+            else:
+                resume_after = last_exported_idx(config.old_run)
+            print(f"Resuming after {resume_after if done_events is None else f'{len(done_events)} events'}...")
+
+        total = count_csv_rows(source_path)
+        print(f"Streaming {total} rows from {source_path} in chunks of {config.chunk_size}")
+        detections = stream_detections(source_path, config, resume_from_pending, resume_after, done_events)
+
+    elif resume_from_pending:
+        detections = pd.read_csv(pending_path, index_col=0)
+        total = len(detections)
+    else:
+        firms_data = pd.read_csv(config.csv_path)
+        firms_data = filter_by_satellite_start_date(firms_data, config.images_satellite)
+        if config.collection_mode == "event":
+            firms_data = cluster_firms_events(firms_data, config.event_max_km)
+        firms_data = prioritize(firms_data, config.priority)
+
+        if config.old_run and config.collection_mode == "event":
+            done_events = done_event_ids(config.old_run)
+            print(f"Resuming, {len(done_events)} events already processed...")
+            firms_data = firms_data[~firms_data['event_id'].isin(done_events)]
+        elif config.old_run:
+            last_image = last_exported_idx(config.old_run)
+            if last_image in firms_data.index:
+                print(f"Resuming from image {last_image}...")
+                firms_data = firms_data.iloc[firms_data.index.get_loc(last_image)+1:]
+
+        detections = firms_data
+        total = len(firms_data)
+
+    print(f"{total} points loaded from {config.csv_path}")
+
+    budget = Budget(config.max_run_seconds, config.max_rpcs, config.max_download_bytes)
+
+    # pending.csv may be the input being read, the new one is written aside and swapped at the end
+    new_pending_path = pending_path + ".tmp"
+    if os.path.exists(new_pending_path):
+        os.remove(new_pending_path)
+
+    n_pending = process_data(detections, config, budget, new_pending_path, total)
+
+    print(f"CSV file saved as: {config.output_csv}")
+    print(f"Images saved in: {config.output_img_dir}")
+    print(f"Resources used: {budget.summary()}")
+
+    if n_pending > 0:
+        os.replace(new_pending_path, pending_path)
+        print(f"Budget exhausted, {n_pending} detections left in {pending_path}. Set OLD_RUN_DIR to {config.output_img_dir} to resume.")
+        return
+
+    if os.path.exists(pending_path):
+        os.remove(pending_path)
+    Path(config.output_img_dir, "job_completed").touch()
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config(args.config)
+
+    if args.plan:
+        from collection_plan import print_plan
+        print_plan(config)
+        return
+
+    run_collection(config)
+
+if __name__ == "__main__":
 
-    print(f"CSV file saved as: {OUTPUT_CSV}")
-    print(f"Images saved in: {OUTPUT_IMG_DIR}")
-    Path(OUTPUT_IMG_DIR, "job_completed").touch()
+    main()
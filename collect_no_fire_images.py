@@ -1,41 +1,64 @@
 import os
-import ee
 import json
+import argparse
 import datetime
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-import random
 import concurrent.futures
+from dataclasses import dataclass
 
 from collect_images import download_thumbnail
+from detection_table import build_detection_table, epoch_to_datetime, epoch_to_str, firms_epochs, region_coordinates
 
 CONFIG_FILE = "config/collect_no_fire_images_config.json"
+INPUT_CSV = "data/fire/firms_features_merged.csv"
 
-with open(CONFIG_FILE, "r") as f:
-    config = json.load(f)
-
-GEE_PROJECT = config.get("GEE_PROJECT")
-IMAGES_SATELLITE = config.get("IMAGES_SATELLITE", 'sentinel-2')
-THUMB_SIZE = config.get("THUMB_SIZE", 256)
-BUFFER_METERS = config.get("BUFFER_METERS")
-OUTPUT_IMG_DIR = f"data/no_fire_images_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
-OUTPUT_CSV = os.path.join(OUTPUT_IMG_DIR, "no_fire_images.csv")
-NUM_THREADS = config.get("NUM_THREADS", 4)
-
-os.makedirs(OUTPUT_IMG_DIR, exist_ok=True)
+# Images are searched within this many days of the random target date
+SEARCH_WINDOW_DAYS = 7
 
 COLUMNS = ['latitude', 'longitude', 'image_date', 'thumbnail_file', 
            'satellite_image_source', 'country', 'firms_sensor']
 
-def random_past_date_from_row(row_date_str):
-    base_date = datetime.datetime.fromisoformat(row_date_str)
-    months_back = random.randint(1, 13)
-    days_back = random.randint(0, 30)
-    return base_date - datetime.timedelta(days=30*months_back + days_back)
 
-def get_ee_image(point, target_date):
-    start_date = target_date - datetime.timedelta(days=7)
-    end_date = target_date + datetime.timedelta(days=7)
+@dataclass
+class NoFireConfig:
+    """Resolved settings for one no-fire image collection run."""
+    gee_project: str
+    output_img_dir: str
+    images_satellite: str = 'sentinel-2'
+    thumb_size: int = 256
+    buffer_meters: float = 2000
+    num_threads: int = 4
+
+    @property
+    def output_csv(self):
+        return os.path.join(self.output_img_dir, "no_fire_images.csv")
+
+
+def load_config(config_file=CONFIG_FILE):
+    with open(config_file, "r") as f:
+        config = json.load(f)
+
+    return NoFireConfig(
+        gee_project=config.get("GEE_PROJECT"),
+        output_img_dir=f"data/no_fire_images_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        images_satellite=config.get("IMAGES_SATELLITE", 'sentinel-2'),
+        thumb_size=config.get("THUMB_SIZE", 256),
+        buffer_meters=config.get("BUFFER_METERS", 2000),
+        num_threads=config.get("NUM_THREADS", 4),
+    )
+
+def random_past_epochs(epochs, rng=None):
+    """Random dates 1 to 13 months (plus 0 to 30 days) before each epoch, for all rows at once."""
+    rng = np.random.default_rng() if rng is None else rng
+    months_back = rng.integers(1, 14, size=len(epochs))
+    days_back = rng.integers(0, 31, size=len(epochs))
+    return np.asarray(epochs) - (30 * months_back + days_back) * 86400
+
+def get_ee_image(point, target_date, start_date, end_date):
+    import ee
+
     collection = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")\
         .filterBounds(point)\
         .filterDate(start_date, end_date)
@@ -54,30 +77,41 @@ def get_ee_image(point, target_date):
         required_bands = ['B4','B3','B2']
         if not all(b in bands for b in required_bands):
             continue
-        img_date = datetime.datetime.utcfromtimestamp(info['properties']['system:time_start'] / 1000)
+        img_date = epoch_to_datetime(info['properties']['system:time_start'] / 1000)
         diff = abs((img_date - target_date).total_seconds())
         if min_diff is None or diff < min_diff:
             min_diff = diff
             closest_image = img
     return closest_image
 
-def process_row(idx, row):
-    lat, lon = row['latitude'], row['longitude']
+def process_row(position, table, labels, config):
+    """
+    Downloads a no-fire image for the detection at `position` of the detection table, whose
+    epoch is the random target date. labels holds the thumbnail_file / country / firms_sensor arrays.
+    """
+    import ee
+
+    record = table[position]
+    idx = int(record['det_id'])
+    lat, lon = float(record['latitude']), float(record['longitude'])
     point = ee.Geometry.Point(lon, lat)
-    random_date = random_past_date_from_row(row['FIRMS_date'])
-    image = get_ee_image(point, random_date)
+    random_date = epoch_to_datetime(record['epoch'])
+    image = get_ee_image(point, random_date, epoch_to_datetime(record['window_start']), epoch_to_datetime(record['window_end']))
     if image is None:
         print(f"No image found for point {idx} at random date {random_date}")
         return None
-    
-    original_name = row.get('thumbnail_file', f"point_{idx}.png")
+
+    country_label = labels['country'][position]
+    original_name = labels['thumbnail_file'][position]
+    if not isinstance(original_name, str):
+        original_name = f"point_{idx}.png"
     base_name, ext = os.path.splitext(original_name)
-    country = row.get('country', 'unknown_country').replace(" ", "_")
-    filename = os.path.join(OUTPUT_IMG_DIR, f"no_fire_{country}_{base_name}{ext}")
+    country = (country_label if isinstance(country_label, str) else 'unknown_country').replace(" ", "_")
+    filename = os.path.join(config.output_img_dir, f"no_fire_{country}_{base_name}{ext}")
 
     max_retries = 3
     for attempt in range(1, max_retries + 1):
-        success = download_thumbnail(image, filename, point, 'sentinel-2', size=THUMB_SIZE)
+        success = download_thumbnail(image, filename, None, 'sentinel-2', size=config.thumb_size, region=region_coordinates(record))
         if success:
             break
         else:
@@ -90,33 +124,58 @@ def process_row(idx, row):
     result = {
         'latitude': lat,
         'longitude': lon,
-        'image_date': random_date.isoformat(),
+        'image_date': epoch_to_str(record['epoch']),
         'thumbnail_file': os.path.basename(filename),
-        'satellite_image_source': IMAGES_SATELLITE,
-        'country': row.get('country', None),
-        'firms_sensor': row.get('firms_sensor', None)
+        'satellite_image_source': config.images_satellite,
+        'country': country_label,
+        'firms_sensor': labels['firms_sensor'][position]
     }
     pd.DataFrame([result]).to_csv(
-        OUTPUT_CSV,
+        config.output_csv,
         mode='a',
-        header=not os.path.exists(OUTPUT_CSV),
+        header=not os.path.exists(config.output_csv),
         index=False
     )
     return result
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    import ee
 
-    ee.Initialize(project=GEE_PROJECT)
+    parser = argparse.ArgumentParser(description="Download no-fire thumbnails for previously collected fire points.")
+    parser.add_argument("--config", default=CONFIG_FILE, help="JSON config file (see config/collect_no_fire_images_config_example.json).")
+    parser.add_argument("--input-csv", default=INPUT_CSV, help="Merged fire features CSV to sample points from.")
+    args = parser.parse_args(argv)
 
-    df = pd.read_csv("data/fire/firms_features_merged.csv")
+    config = load_config(args.config)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+    ee.Initialize(project=config.gee_project)
+
+    os.makedirs(config.output_img_dir, exist_ok=True)
+
+    df = pd.read_csv(args.input_csv)
+
+    table = build_detection_table(
+        df.index.to_numpy(),
+        df['latitude'].to_numpy(),
+        df['longitude'].to_numpy(),
+        random_past_epochs(firms_epochs(df)),
+        SEARCH_WINDOW_DAYS * 24,
+        config.buffer_meters
+    )
+    labels = {col: df[col].to_numpy() if col in df.columns else np.full(len(df), None) for col in ['thumbnail_file', 'country', 'firms_sensor']}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config.num_threads) as executor:
         list(
             tqdm(
-                executor.map(lambda args: process_row(*args), [(idx, row) for idx, row in df.iterrows()]),
-                total=len(df)
+                executor.map(lambda position: process_row(position, table, labels, config), range(len(table))),
+                total=len(table)
             )
         )
 
-    print(f"Download completed, images saved to {OUTPUT_CSV}")
+    print(f"Download completed, images saved to {config.output_csv}")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,220 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from patches import NATIVE_SCALES, PATCH_BANDS
+from mosaic import MOSAIC_MAX_PIXELS, MOSAIC_TILE_PX, mosaic_cells, mosaic_grid
+from detection_table import METERS_PER_DEGREE, buffer_bounds, firms_epochs
+
+# Estimates for a collection run made without any Earth Engine call: the detections are read
+# locally and the images available in each time window are derived from the revisit cadence.
+# Scene cloud filtering and invalid images are not modelled, so image counts are upper bounds.
+
+# Nominal revisit (hours) of each satellite over a given point
+REVISIT_HOURS = {
+    "sentinel-2": 5 * 24,
+    "landsat-8": 16 * 24,
+    "aqua": 24,
+    "fengyun": 0.25
+}
+
+# Typical request costs, used to turn counts into wall-clock time
+RPC_SECONDS = 0.5               # getInfo round trip
+DOWNLOAD_SECONDS = 2.0          # getThumbURL / getDownloadURL rendering before the first byte
+DOWNLOAD_BYTES_PER_SECOND = 10e6
+EE_MAX_CONCURRENT = 40          # concurrent interactive requests allowed per project
+
+# Average size of the PNG thumbnails (RGBA, 8 bit) and of the NPY patches (16 bit bands)
+PNG_BYTES_PER_PIXEL = 2.0
+PATCH_BYTES_PER_VALUE = 2
+
+# Detections read at a time
+PLAN_CHUNKSIZE = 1_000_000
+PLAN_COLUMNS = ['latitude', 'longitude', 'acq_date', 'acq_time']
+
+def images_in_window(epochs, max_time_diff_hours, satellite, max_images):
+    """
+    (first revisit slot, selected images) of each detection, with images assumed every
+    REVISIT_HOURS and the first max_images of the window [epoch - diff, epoch + diff) taken.
+    """
+    revisit = int(REVISIT_HOURS[satellite] * 3600)
+    window = int(max_time_diff_hours * 3600)
+    first = -((window - epochs) // revisit)                 # ceil((epoch - window) / revisit)
+    last = (epochs + window - 1) // revisit
+    return first, np.clip(last - first + 1, 0, max_images)
+
+def export_sizes(config):
+    """(downloads, RPCs, bytes) of exporting one point or event image according to EXPORT_MODE."""
+    satellite = config.images_satellite
+    downloads, nbytes = 0, 0.0
+
+    if config.export_mode in ("thumbnail", "both"):
+        downloads += 1
+        nbytes += config.thumb_size ** 2 * PNG_BYTES_PER_PIXEL
+
+    if config.export_mode in ("patch", "both"):
+        downloads += 1
+        side = 2 * config.buffer_meters / (config.patch_scale or NATIVE_SCALES[satellite])
+        if config.collection_mode == "event":
+            side = config.thumb_size
+        nbytes += side ** 2 * len(PATCH_BANDS[satellite]) * PATCH_BYTES_PER_VALUE
+
+    return downloads, downloads, nbytes
+
+def event_units(df, epochs, max_km):
+    """
+    Epochs of the approximate fire events of a chunk: detections of the same acquisition in the
+    same max_km grid cell. Upper bound of the DBSCAN events, which can chain across cells.
+    """
+    cell_deg = max_km * 1000 / METERS_PER_DEGREE
+    keys = pd.DataFrame({
+        'epoch': epochs,
+        'y': np.floor(df['latitude'].to_numpy() / cell_deg),
+        'x': np.floor(df['longitude'].to_numpy() * np.cos(np.radians(df['latitude'].to_numpy())) / cell_deg),
+    })
+    return keys.drop_duplicates()['epoch'].to_numpy()
+
+def mosaic_pixel_meters(config):
+    """Pixel size (meters) of the mosaics, as in collect_images.process_mosaic_image."""
+    return max(NATIVE_SCALES[config.images_satellite], 2 * config.buffer_meters / config.thumb_size)
+
+def mosaic_images(df, epochs, first, n_selected, config):
+    """
+    Bounds of the area downloaded from each (week group, image, cell) of a chunk in mosaic mode.
+    DataFrame indexed by (group, slot, row, col) with west / south / east / north.
+    """
+    from collect_images import MOSAIC_GROUP_DAYS
+
+    west, south, east, north = buffer_bounds(df['latitude'], df['longitude'], config.buffer_meters)
+    rows, cols = mosaic_cells(df['latitude'], df['longitude'], mosaic_pixel_meters(config))
+    group = epochs // (MOSAIC_GROUP_DAYS * 24 * 3600)
+
+    parts = []
+    for i in range(config.max_images_per_point):
+        taken = n_selected > i
+        parts.append(pd.DataFrame({
+            'group': group[taken], 'slot': first[taken] + i, 'row': rows[taken], 'col': cols[taken],
+            'west': west[taken], 'south': south[taken], 'east': east[taken], 'north': north[taken]
+        }))
+    return pd.concat(parts).groupby(['group', 'slot', 'row', 'col']).agg(
+        {'west': 'min', 'south': 'min', 'east': 'max', 'north': 'max'}
+    )
+
+def read_detections(config):
+    """Chunks of the detections the run would process (pending.csv when resuming a stopped run)."""
+    from collect_images import PENDING_FILE
+
+    pending_path = os.path.join(config.output_img_dir, PENDING_FILE)
+    if config.old_run and os.path.exists(pending_path):
+        return pending_path, pd.read_csv(pending_path, usecols=PLAN_COLUMNS, chunksize=PLAN_CHUNKSIZE)
+    return config.csv_path, pd.read_csv(config.csv_path, usecols=PLAN_COLUMNS, chunksize=PLAN_CHUNKSIZE)
+
+def estimate_collection(config):
+    """
+    Expected detections, searches, images, RPCs, downloads, bytes and wall-clock time of a
+    collection run, computed locally in a single streaming pass over the detections.
+    """
+    from collect_images import filter_by_satellite_start_date
+
+    satellite = config.images_satellite
+    source, chunks = read_detections(config)
+
+    totals = dict(rows=0, detections=0, searches=0, images=0, rpcs=0, downloads=0, bytes=0.0)
+    mosaic_parts = []
+    export_downloads, export_rpcs, export_bytes = export_sizes(config)
+
+    for chunk in chunks:
+        totals['rows'] += len(chunk)
+        df = filter_by_satellite_start_date(chunk, satellite, sort=False, verbose=False)
+        if df.empty:
+            continue
+        epochs = firms_epochs(df)
+        totals['detections'] += len(df)
+
+        if config.collection_mode == "mosaic":
+            first, n_selected = images_in_window(epochs, config.max_time_diff_hours, satellite, config.max_images_per_point)
+            mosaic_parts.append(mosaic_images(df, epochs, first, n_selected, config))
+            continue
+
+        if config.collection_mode == "event":
+            epochs = event_units(df, epochs, config.event_max_km)
+
+        _, n_selected = images_in_window(epochs, config.max_time_diff_hours, satellite, config.max_images_per_point)
+        n_images = int(n_selected.sum())
+        n_found = int((n_selected > 0).sum())
+        totals['searches'] += len(epochs)
+        totals['images'] += n_images
+        totals['bytes'] += n_images * export_bytes
+
+        if config.collection_mode == "stack":
+            # collection size, then one metadata request and one filmstrip per detection with images
+            totals['rpcs'] += len(epochs) + 2 * n_found
+            totals['downloads'] += n_found
+        else:
+            # select_images: collection size, list size and one getInfo per image, then the exports
+            totals['rpcs'] += len(epochs) + n_found + n_images + n_images * export_rpcs
+            totals['downloads'] += n_images * export_downloads
+
+    if mosaic_parts:
+        # list_images: collection size and one dictionary per week group, then the tiles of each image cell
+        cells = pd.concat(mosaic_parts).groupby(level=['group', 'slot', 'row', 'col']).agg(
+            {'west': 'min', 'south': 'min', 'east': 'max', 'north': 'max'}
+        )
+        pixel_meters = mosaic_pixel_meters(config)
+        totals['searches'] = cells.index.get_level_values('group').nunique()
+        totals['images'] = cells.index.droplevel(['row', 'col']).nunique()
+        totals['rpcs'] = 2 * totals['searches']
+        for bounds in cells.itertuples(index=False):
+            _, width, height = mosaic_grid(tuple(bounds), pixel_meters)
+            if width * height > MOSAIC_MAX_PIXELS:
+                continue
+            tiles = -(-width // MOSAIC_TILE_PX) * -(-height // MOSAIC_TILE_PX)
+            totals['rpcs'] += tiles
+            totals['downloads'] += tiles
+            totals['bytes'] += width * height * PNG_BYTES_PER_PIXEL
+
+    concurrency = min(config.num_threads, EE_MAX_CONCURRENT)
+    totals['seconds'] = (
+        (totals['rpcs'] - totals['downloads']) * RPC_SECONDS
+        + totals['downloads'] * DOWNLOAD_SECONDS
+        + totals['bytes'] / DOWNLOAD_BYTES_PER_SECOND
+    ) / concurrency
+    totals['source'] = source
+    totals['concurrency'] = concurrency
+    return totals
+
+def budget_fraction(plan, config):
+    """Fraction of the run that fits in the configured BUDGET (1.0 without limits)."""
+    fractions = [1.0]
+    for limit, used in ((config.max_run_seconds, plan['seconds']), (config.max_rpcs, plan['rpcs']), (config.max_download_bytes, plan['bytes'])):
+        if limit is not None and used > 0:
+            fractions.append(limit / used)
+    return min(fractions)
+
+def print_plan(config):
+    """Prints the estimates of a collection run. No Earth Engine call is made."""
+    if not os.path.exists(config.csv_path):
+        print(f"FIRMS CSV file not found {config.csv_path}, nothing to plan (run download_firms_data.py first).")
+        return None
+
+    start = time.monotonic()
+    plan = estimate_collection(config)
+    units = {"mosaic": "week groups", "event": "events (approx.)"}.get(config.collection_mode, "detections")
+
+    print(f"Plan for {config.images_satellite} ({config.collection_mode} mode, {config.export_mode}) from {plan['source']}")
+    print(f"  Detections:      {plan['detections']} of {plan['rows']} rows after the start date filter")
+    print(f"  Searches:        {plan['searches']} {units}")
+    print(f"  Images:          {plan['images']} (revisit {REVISIT_HOURS[config.images_satellite]} h, window ±{config.max_time_diff_hours} h, upper bound)")
+    print(f"  EE RPCs:         {plan['rpcs']}")
+    print(f"  Downloads:       {plan['downloads']}")
+    print(f"  Bytes:           {plan['bytes'] / 1e9:.2f} GB")
+    duration = f"{plan['seconds'] / 3600:.1f} h" if plan['seconds'] >= 3600 else f"{plan['seconds'] / 60:.0f} min"
+    print(f"  Wall-clock:      {duration} at {plan['concurrency']} concurrent requests")
+
+    fraction = budget_fraction(plan, config)
+    if fraction < 1:
+        print(f"  BUDGET stops the run after about {100 * fraction:.0f}% of the work")
+
+    print(f"Planned in {time.monotonic() - start:.1f} s")
+    return plan
@@ -0,0 +1,163 @@
+import os
+import io
+import pickle
+import zipfile
+import argparse
+import requests
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+# geopandas and shapely are imported inside the functions that use them so that
+# importing this module stays cheap.
+
+WORLD_DIR = "data/world"
+NATURAL_EARTH_URL = "https://naciscdn.org/naturalearth/{scale}/cultural/{name}.zip"
+
+# Natural Earth layer, scale and name attribute of each assignment level
+LAYERS = {
+    "admin0": ("ne_10m_admin_0_countries", "10m", "ADMIN"),
+    "admin1": ("ne_10m_admin_1_states_provinces", "10m", "name"),
+}
+
+# Points outside every polygon (coast, estuaries, lakes) take the nearest polygon within this distance (degrees)
+MAX_NEAREST_DEG = 0.5
+
+# Points built and queried at once
+CHUNK_POINTS = 1_000_000
+
+def download_natural_earth(name, scale, world_dir=WORLD_DIR):
+    """
+    Downloads a Natural Earth cultural layer if not present, extracts it into
+    world_dir and returns the path of its shapefile.
+    """
+    shapefile_path = os.path.join(world_dir, f"{name}.shp")
+
+    if not os.path.exists(shapefile_path):
+        print(f"Downloading Natural Earth {name}...")
+
+        os.makedirs(world_dir, exist_ok=True)
+
+        r = requests.get(NATURAL_EARTH_URL.format(scale=scale, name=name))
+
+        # Check if response is ZIP
+        if r.status_code != 200 or r.content[:2] != b'PK':
+            raise ValueError("Download failed, file is not a valid ZIP. URL may be down.")
+
+        z = zipfile.ZipFile(io.BytesIO(r.content))
+        z.extractall(world_dir)
+
+        print(f"{name} downloaded and extracted successfully.")
+
+    return shapefile_path
+
+def load_layer(level, world_dir=WORLD_DIR):
+    """
+    (names, geometries) arrays of an assignment level. The parsed geometries are cached
+    in {world_dir}/{layer}.pkl, so the shapefile is only read the first time.
+    """
+    name, scale, name_field = LAYERS[level]
+    cache_path = os.path.join(world_dir, f"{name}.pkl")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+
+    import geopandas as gpd
+
+    layer = gpd.read_file(download_natural_earth(name, scale, world_dir))
+    names = layer[name_field].to_numpy(dtype=object)
+    geometries = layer.geometry.to_numpy()
+
+    with open(cache_path, "wb") as f:
+        pickle.dump((names, geometries), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return names, geometries
+
+@lru_cache(maxsize=None)
+def prepared_layer(level, world_dir=WORLD_DIR):
+    """(names, prepared geometries) of an assignment level, loaded once per process."""
+    import shapely
+
+    names, geometries = load_layer(level, world_dir)
+    shapely.prepare(geometries)
+    return names, geometries
+
+def nearest_polygon(points, geometries, max_distance):
+    """
+    (point_idx, polygon_idx) of the points that have a polygon within max_distance, with
+    the nearest one. Exact distances are only computed for points near several polygons.
+    """
+    import shapely
+
+    polygon_idx, point_idx = shapely.STRtree(points).query(geometries, predicate='dwithin', distance=max_distance)
+
+    shared = np.bincount(point_idx, minlength=len(points))[point_idx] > 1
+    distance = np.zeros(len(point_idx))
+    distance[shared] = shapely.distance(points[point_idx[shared]], geometries[polygon_idx[shared]])
+
+    order = np.lexsort((distance, point_idx))
+    point_idx, polygon_idx = point_idx[order], polygon_idx[order]
+    first = np.r_[True, point_idx[1:] != point_idx[:-1]]
+    return point_idx[first], polygon_idx[first]
+
+def assign_regions(latitudes, longitudes, level="admin0", max_nearest_deg=MAX_NEAREST_DEG):
+    """
+    Name of the polygon of the level containing each coordinate. The points of each chunk
+    go into a spatial index that every prepared polygon queries with a vectorized
+    point-in-polygon test. Points outside every polygon take the nearest one within
+    max_nearest_deg (None disables it). Unassigned points are None.
+    """
+    import shapely
+
+    names, geometries = prepared_layer(level)
+
+    latitudes = np.asarray(latitudes, dtype='f8')
+    longitudes = np.asarray(longitudes, dtype='f8')
+    result = np.full(len(latitudes), None, dtype=object)
+
+    for start in range(0, len(latitudes), CHUNK_POINTS):
+        lats = latitudes[start:start + CHUNK_POINTS]
+        lons = longitudes[start:start + CHUNK_POINTS]
+        valid = start + np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+        points = shapely.points(longitudes[valid], latitudes[valid])
+
+        polygon_idx, point_idx = shapely.STRtree(points).query(geometries, predicate='contains')
+        found = np.zeros(len(points), dtype=bool)
+        found[point_idx] = True
+        result[valid[point_idx]] = names[polygon_idx]
+
+        missing = np.flatnonzero(~found)
+        if len(missing) and max_nearest_deg is not None:
+            point_idx, polygon_idx = nearest_polygon(points[missing], geometries, max_nearest_deg)
+            result[valid[missing[point_idx]]] = names[polygon_idx]
+
+    return result
+
+def add_region_columns(df, admin1=False, max_nearest_deg=MAX_NEAREST_DEG):
+    """Sets the country (and admin1) column of a detections DataFrame from its latitude / longitude."""
+    df['country'] = assign_regions(df['latitude'], df['longitude'], "admin0", max_nearest_deg)
+    if admin1:
+        df['admin1'] = assign_regions(df['latitude'], df['longitude'], "admin1", max_nearest_deg)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tag a detections CSV with country (and admin-1) by spatial join on Natural Earth.")
+    parser.add_argument("input_csv")
+    parser.add_argument("output_csv")
+    parser.add_argument("--admin1", action="store_true")
+    parser.add_argument("--max-nearest-deg", type=float, default=MAX_NEAREST_DEG)
+    parser.add_argument("--chunksize", type=int, default=CHUNK_POINTS)
+    args = parser.parse_args(argv)
+
+    rows = 0
+    for i, chunk in enumerate(pd.read_csv(args.input_csv, chunksize=args.chunksize)):
+        add_region_columns(chunk, args.admin1, args.max_nearest_deg)
+        chunk.to_csv(args.output_csv, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+        rows += len(chunk)
+
+    print(f"{rows} detections tagged, saved to {args.output_csv}")
+
+if __name__ == "__main__":
+    main()
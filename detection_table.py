@@ -0,0 +1,76 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+METERS_PER_DEGREE = 111320
+
+# One record per detection. Times are UTC epoch seconds, bounds are the lon/lat box
+# of the buffer around the detection.
+DETECTION_DTYPE = np.dtype([
+    ('det_id', 'i8'),
+    ('latitude', 'f8'),
+    ('longitude', 'f8'),
+    ('epoch', 'i8'),
+    ('window_start', 'i8'),
+    ('window_end', 'i8'),
+    ('west', 'f8'),
+    ('south', 'f8'),
+    ('east', 'f8'),
+    ('north', 'f8'),
+])
+
+def firms_epochs(df):
+    """
+    UTC epoch seconds of each detection, parsed in one vectorized pass from
+    acq_date / acq_time (raw FIRMS) or FIRMS_date (collected features).
+    """
+    if 'acq_date' in df.columns:
+        days = pd.to_datetime(df['acq_date'], format="%Y-%m-%d")
+        acq_time = pd.to_numeric(df['acq_time']).to_numpy().astype('i8')
+        seconds = (acq_time // 100) * 3600 + (acq_time % 100) * 60
+        return days.to_numpy().astype('datetime64[s]').astype('i8') + seconds
+    return pd.to_datetime(df['FIRMS_date'], format="ISO8601").to_numpy().astype('datetime64[s]').astype('i8')
+
+def buffer_bounds(latitudes, longitudes, buffer_meters):
+    """(west, south, east, north) arrays of the box around each coordinate expanded by buffer_meters."""
+    latitudes = np.asarray(latitudes, dtype='f8')
+    longitudes = np.asarray(longitudes, dtype='f8')
+    dlat = buffer_meters / METERS_PER_DEGREE
+    dlon = buffer_meters / (METERS_PER_DEGREE * np.cos(np.radians(latitudes)))
+    return longitudes - dlon, latitudes - dlat, longitudes + dlon, latitudes + dlat
+
+def build_detection_table(det_ids, latitudes, longitudes, epochs, max_time_diff_hours, buffer_meters):
+    table = np.empty(len(epochs), dtype=DETECTION_DTYPE)
+    window = int(max_time_diff_hours * 3600)
+
+    table['det_id'] = det_ids
+    table['latitude'] = latitudes
+    table['longitude'] = longitudes
+    table['epoch'] = epochs
+    table['window_start'] = table['epoch'] - window
+    table['window_end'] = table['epoch'] + window
+    table['west'], table['south'], table['east'], table['north'] = buffer_bounds(latitudes, longitudes, buffer_meters)
+    return table
+
+def detection_table_from_df(df, max_time_diff_hours, buffer_meters):
+    """Converts a FIRMS DataFrame into a detection table. det_id is the DataFrame index."""
+    return build_detection_table(
+        df.index.to_numpy(),
+        df['latitude'].to_numpy(),
+        df['longitude'].to_numpy(),
+        firms_epochs(df),
+        max_time_diff_hours,
+        buffer_meters
+    )
+
+def epoch_to_datetime(epoch):
+    return datetime.datetime.fromtimestamp(int(epoch), tz=datetime.timezone.utc)
+
+def epoch_to_str(epoch):
+    """'YYYY-MM-DDTHH:MM:SS', the FIRMS_date format of firms_features.csv."""
+    return epoch_to_datetime(epoch).strftime("%Y-%m-%dT%H:%M:%S")
+
+def region_coordinates(record):
+    """Closed lon/lat ring of the buffer box of a table record, as expected by getThumbURL."""
+    west, south, east, north = (float(record[k]) for k in ('west', 'south', 'east', 'north'))
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
@@ -1,23 +1,15 @@
 import os
 import json
+import argparse
 import requests
 import pandas as pd
 from glob import glob
 from time import sleep
+from functools import lru_cache
 
 CONFG_FILE_NAME = "config/download_firms_csv_config.json"
-
-with open(CONFG_FILE_NAME, "r") as f:
-    config = json.load(f)
-
-COUNTRY = config.get("COUNTRY", None)
-INSTRUMENT = config.get("INSTRUMENT", "ALL") # Instument options: "MODIS", "VIIRS S-NPP", "VIIRS NOAA-20", "ALL"
-
-if COUNTRY is None:
-    raise ValueError("COUNTRY must be specified in the config file.")
-
-with open("config/instrument_map.json", "r") as f:
-    instrument_map = json.load(f)
+INSTRUMENT_MAP_FILE = "config/instrument_map.json"
+FIRMS_DATA_DIR = "data/firms_data"
 
 start_year_map = {
     "MODIS": 2000,
@@ -25,6 +17,35 @@ start_year_map = {
     "VIIRS NOAA-20": 2018
 }
 
+@lru_cache(maxsize=None)
+def load_instrument_map(path=INSTRUMENT_MAP_FILE):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def load_config(config_file=CONFG_FILE_NAME):
+    """
+    Reads the download config and returns (country, instrument).
+    Instrument options: "MODIS", "VIIRS S-NPP", "VIIRS NOAA-20", "ALL".
+    """
+    with open(config_file, "r") as f:
+        config = json.load(f)
+
+    country = config.get("COUNTRY", None)
+    instrument = config.get("INSTRUMENT", "ALL")
+
+    if country is None:
+        raise ValueError("COUNTRY must be specified in the config file.")
+
+    return country, instrument
+
+def firms_country_dir(country, instrument):
+    return os.path.join(FIRMS_DATA_DIR, instrument.replace(' ', '_'), country.replace(' ', '_'))
+
+def firms_csv_path(country, instrument):
+    """Path of the merged per-country CSV written by download_firms_data."""
+    instr_code = load_instrument_map()[instrument]
+    return os.path.join(firms_country_dir(country, instrument), f"{instr_code}_{country.replace(' ', '_')}.csv")
+
 def download_yearly_csv(country_name, year, instr_code, save_dir):
     fname = f"{instr_code}_{year}_{country_name}.csv"
     url = f"https://firms.modaps.eosdis.nasa.gov/data/country/{instr_code}/{year}/{fname}"
@@ -44,7 +65,9 @@ def download_yearly_csv(country_name, year, instr_code, save_dir):
 
 def download_firms_data(country, instrument="ALL", end_year=2024):
 
-    if INSTRUMENT not in instrument_map and INSTRUMENT != "ALL":
+    instrument_map = load_instrument_map()
+
+    if instrument not in instrument_map and instrument != "ALL":
         raise ValueError(f"Invalid instrument. Options are: {list(instrument_map.keys())}")
 
     if instrument == "ALL":
@@ -56,8 +79,7 @@ def download_firms_data(country, instrument="ALL", end_year=2024):
         start_year = start_year_map[instrument]
         instr_code = instrument_map[instrument]
 
-        base_output_dir = f"data/firms_data/{instrument.replace(' ', '_')}"
-        country_output_dir = os.path.join(base_output_dir, country.replace(' ', '_'))
+        country_output_dir = firms_country_dir(country, instrument)
         os.makedirs(country_output_dir, exist_ok=True)
 
         for year in range(start_year, end_year + 1):
@@ -68,8 +90,7 @@ def download_firms_data(country, instrument="ALL", end_year=2024):
         # Concatenate yearly CSVs
         instr_code = instrument_map[instrument]
 
-        base_output_dir = f"data/firms_data/{instrument.replace(' ', '_')}"
-        country_output_dir = os.path.join(base_output_dir, country.replace(' ', '_'))
+        country_output_dir = firms_country_dir(country, instrument)
 
         all_files = glob(os.path.join(country_output_dir, f"{instr_code}_*.csv"))
         dfs = []
@@ -82,13 +103,21 @@ def download_firms_data(country, instrument="ALL", end_year=2024):
 
         if dfs:
             df_all = pd.concat(dfs, ignore_index=True)
-            merged_fname = os.path.join(country_output_dir, f"{instr_code}_{country.replace(' ', '_')}.csv")
+            merged_fname = firms_csv_path(country, instrument)
             df_all.to_csv(merged_fname, index=False)
             print(f"CSV saved in: {merged_fname}")
             print(f"All files: {len(dfs)}, total rows: {len(df_all)}")
         else:
             print("No valid files found to concatenate.")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download yearly FIRMS country CSVs and merge them.")
+    parser.add_argument("--config", default=CONFG_FILE_NAME, help="JSON config with COUNTRY and INSTRUMENT.")
+    args = parser.parse_args(argv)
+
+    country, instrument = load_config(args.config)
+    download_firms_data(country, instrument)
+
 if __name__ == "__main__":
 
-    download_firms_data(COUNTRY, INSTRUMENT)
+    main()
@@ -12,21 +12,30 @@ Sur   = -33.8
 Este  = -49.0
 Oeste = -57.5
 
-# ---------------------------
-# Leer CSV
-# ---------------------------
-df = pd.read_csv(csv_path)
-
-# FIRMS suele tener columnas 'latitude' y 'longitude' para coordenadas
-# Filtrar por cuadrante
-df_filtered = df[
-    (df['latitude'] <= Norte) &
-    (df['latitude'] >= Sur) &
-    (df['longitude'] <= Este) &
-    (df['longitude'] >= Oeste)
-]
-
-# Guardar CSV filtrado
-df_filtered.to_csv(output_path, index=False)
-print(f"Filtrado completado. Filas originales: {len(df)}, filas después del filtro: {len(df_filtered)}")
-print(f"CSV filtrado guardado en: {output_path}")
+def filter_by_sector(df, norte=Norte, sur=Sur, este=Este, oeste=Oeste):
+    # FIRMS suele tener columnas 'latitude' y 'longitude' para coordenadas
+    # Filtrar por cuadrante
+    return df[
+        (df['latitude'] <= norte) &
+        (df['latitude'] >= sur) &
+        (df['longitude'] <= este) &
+        (df['longitude'] >= oeste)
+    ]
+
+def filter_csv_by_sector(csv_path=csv_path, output_path=output_path, norte=Norte, sur=Sur, este=Este, oeste=Oeste):
+    # ---------------------------
+    # Leer CSV
+    # ---------------------------
+    df = pd.read_csv(csv_path)
+
+    df_filtered = filter_by_sector(df, norte, sur, este, oeste)
+
+    # Guardar CSV filtrado
+    df_filtered.to_csv(output_path, index=False)
+    print(f"Filtrado completado. Filas originales: {len(df)}, filas después del filtro: {len(df_filtered)}")
+    print(f"CSV filtrado guardado en: {output_path}")
+
+    return df_filtered
+
+if __name__ == "__main__":
+    filter_csv_by_sector()
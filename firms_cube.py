@@ -0,0 +1,212 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import concurrent.futures
+
+from download_firms_data import FIRMS_DATA_DIR, load_instrument_map
+from run_dirs import load_json, save_json
+
+CUBE_DIR = "data/firms_cube"
+MANIFEST_FILE = "manifest.json"
+
+# Size (degrees) of the coarse grid cells
+GRID_DEG = 1.0
+
+DIMENSIONS = ['instrument', 'country', 'year', 'month', 'hour', 'daynight', 'grid_lat', 'grid_lon']
+MEASURES = ['count', 'frp_sum']
+
+CHUNKSIZE = 500_000
+
+# Version of the aggregation, part of the partition fingerprint so that a change rebuilds the cube
+CUBE_VERSION = 2
+
+# Values of missing dimensions (no country, unparseable date, no coordinates), so that
+# every detection is counted in the cube
+MISSING_LABEL = 'unknown'
+MISSING_NUMBER = -1
+MISSING_CELL = -999
+
+# ---------------------------
+# Aggregation
+# ---------------------------
+
+def aggregate_frame(df, instrument=None, country=None, grid_deg=GRID_DEG):
+    """
+    Aggregates detections into cube rows (DIMENSIONS + MEASURES).
+
+    Works on raw FIRMS frames (acq_date, acq_time, daynight, frp) and on collected
+    frames (FIRMS_date and optionally country / firms_sensor). Dates are parsed by
+    slicing the ISO strings, without pd.to_datetime.
+    """
+    if 'acq_date' in df.columns:
+        dates = df['acq_date'].astype(str)
+        hour = pd.to_numeric(df['acq_time'], errors='coerce') // 100
+    else:
+        dates = df['FIRMS_date'].astype(str)
+        hour = pd.to_numeric(dates.str[11:13], errors='coerce')
+
+    if instrument is None:
+        instrument = df['firms_sensor'] if 'firms_sensor' in df.columns else 'unknown'
+    if country is None:
+        country = df['country'] if 'country' in df.columns else 'unknown'
+
+    rows = pd.DataFrame({
+        'instrument': instrument,
+        'country': country,
+        'year': pd.to_numeric(dates.str[:4], errors='coerce'),
+        'month': pd.to_numeric(dates.str[5:7], errors='coerce'),
+        'hour': hour,
+        'daynight': df['daynight'] if 'daynight' in df.columns else 'U',
+        'grid_lat': np.floor(pd.to_numeric(df['latitude'], errors='coerce').to_numpy() / grid_deg),
+        'grid_lon': np.floor(pd.to_numeric(df['longitude'], errors='coerce').to_numpy() / grid_deg),
+        'count': 1,
+        'frp_sum': df['frp'].fillna(0).to_numpy() if 'frp' in df.columns else 0.0,
+    }, index=df.index)
+
+    rows = rows.fillna({
+        'instrument': MISSING_LABEL, 'country': MISSING_LABEL, 'daynight': MISSING_LABEL,
+        'year': MISSING_NUMBER, 'month': MISSING_NUMBER, 'hour': MISSING_NUMBER,
+        'grid_lat': MISSING_CELL, 'grid_lon': MISSING_CELL,
+    })
+    cube = rows.groupby(DIMENSIONS, as_index=False, observed=True, dropna=False)[MEASURES].sum()
+    if cube['count'].sum() != len(df):
+        raise ValueError(f"Cube counts {cube['count'].sum()} detections out of {len(df)}")
+    return cube
+
+def compact(cube):
+    """Small dtypes for storage and fast loading."""
+    cube = cube.copy()
+    for col in ['instrument', 'country', 'daynight']:
+        cube[col] = cube[col].astype('category')
+    for col in ['year', 'grid_lat', 'grid_lon']:
+        cube[col] = cube[col].astype('int16')
+    for col in ['month', 'hour']:
+        cube[col] = cube[col].astype('int8')
+    cube['count'] = cube['count'].astype('int64')
+    cube['frp_sum'] = cube['frp_sum'].astype('float64')
+    return cube
+
+def aggregate_csv(csv_path, instrument, country, grid_deg=GRID_DEG, chunksize=CHUNKSIZE):
+    """Streams a FIRMS CSV in chunks and returns its aggregated cube partition."""
+    usecols = lambda col: col in {'latitude', 'longitude', 'acq_date', 'acq_time', 'daynight', 'frp'}
+
+    partials = [
+        aggregate_frame(chunk, instrument, country, grid_deg)
+        for chunk in pd.read_csv(csv_path, usecols=usecols, chunksize=chunksize)
+    ]
+    if not partials:
+        return pd.DataFrame(columns=DIMENSIONS + MEASURES)
+
+    partition = pd.concat(partials, ignore_index=True)
+    return compact(partition.groupby(DIMENSIONS, as_index=False, observed=True, dropna=False)[MEASURES].sum())
+
+# ---------------------------
+# Partitions on disk
+# ---------------------------
+
+def discover_firms_sources(firms_data_dir=FIRMS_DATA_DIR):
+    """
+    Merged per-country CSVs written by download_firms_data:
+    {firms_data_dir}/{instrument}/{country}/{instr_code}_{country}.csv.
+    Returns a list of (instrument, country, csv_path).
+    """
+    sources = []
+    for instrument, instr_code in load_instrument_map().items():
+        instrument_dir = os.path.join(firms_data_dir, instrument.replace(' ', '_'))
+        if not os.path.isdir(instrument_dir):
+            continue
+        for country_dir in sorted(os.listdir(instrument_dir)):
+            csv_path = os.path.join(instrument_dir, country_dir, f"{instr_code}_{country_dir}.csv")
+            if os.path.exists(csv_path):
+                sources.append((instrument, country_dir.replace('_', ' '), csv_path))
+    return sources
+
+def partition_path(cube_dir, instrument, country):
+    return os.path.join(cube_dir, instrument.replace(' ', '_'), f"{country.replace(' ', '_')}.pkl.gz")
+
+def source_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def load_manifest(cube_dir=CUBE_DIR):
+    return load_json(os.path.join(cube_dir, MANIFEST_FILE), {})
+
+def build_partition(csv_path, instrument, country, out_path, grid_deg):
+    partition = aggregate_csv(csv_path, instrument, country, grid_deg)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    partition.to_pickle(out_path, compression='gzip')
+    return len(partition)
+
+def update_cube(sources=None, cube_dir=CUBE_DIR, grid_deg=GRID_DEG, num_workers=None):
+    """
+    Builds the partitions whose source CSV is new or changed since the last update,
+    one worker process per partition. Unchanged partitions are not touched.
+    """
+    if sources is None:
+        sources = discover_firms_sources()
+
+    manifest = load_manifest(cube_dir)
+    todo = []
+    for instrument, country, csv_path in sources:
+        key = f"{instrument}/{country}"
+        fingerprint = {**source_fingerprint(csv_path), 'source': csv_path, 'grid_deg': grid_deg, 'version': CUBE_VERSION}
+        entry = manifest.get(key, {})
+        if {k: entry.get(k) for k in fingerprint} == fingerprint and os.path.exists(partition_path(cube_dir, instrument, country)):
+            continue
+        todo.append((key, fingerprint, instrument, country, csv_path))
+
+    print(f"FIRMS cube: {len(sources) - len(todo)} partitions up to date, {len(todo)} to build")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            executor.submit(build_partition, csv_path, instrument, country, partition_path(cube_dir, instrument, country), grid_deg): (key, fingerprint)
+            for key, fingerprint, instrument, country, csv_path in todo
+        }
+        for future in concurrent.futures.as_completed(futures):
+            key, fingerprint = futures[future]
+            manifest[key] = {**fingerprint, 'rows': future.result()}
+            print(f"Partition {key} built ({manifest[key]['rows']} cube rows)")
+
+    save_json(manifest, os.path.join(cube_dir, MANIFEST_FILE))
+
+    return manifest
+
+def load_cube(cube_dir=CUBE_DIR, instruments=None, countries=None):
+    """Loads the cube, reading only the partitions of the requested instruments / countries."""
+    parts = []
+    for key in load_manifest(cube_dir):
+        instrument, country = key.split('/', 1)
+        if instruments is not None and instrument not in instruments:
+            continue
+        if countries is not None and country not in countries:
+            continue
+        parts.append(pd.read_pickle(partition_path(cube_dir, instrument, country), compression='gzip'))
+
+    if not parts:
+        return pd.DataFrame(columns=DIMENSIONS + MEASURES)
+    return pd.concat(parts, ignore_index=True)
+
+def cube_slice(cube, by, measure='count', **filters):
+    """
+    Sums a measure over the cube grouped by the `by` dimensions, after filtering
+    dimensions by value, e.g. cube_slice(cube, ['hour', 'instrument'], daynight='D').
+    """
+    for dim, value in filters.items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        cube = cube[cube[dim].isin(values)]
+    return cube.groupby(by, observed=True, dropna=False)[measure].sum()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or update the FIRMS aggregate cube from data/firms_data.")
+    parser.add_argument("--firms-data-dir", default=FIRMS_DATA_DIR)
+    parser.add_argument("--cube-dir", default=CUBE_DIR)
+    parser.add_argument("--grid-deg", type=float, default=GRID_DEG)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    update_cube(discover_firms_sources(args.firms_data_dir), args.cube_dir, args.grid_deg, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,32 @@
 import os
 import pandas as pd
 
+from countries import add_region_columns
+
 def generate_actualized_df(input_dir):
 
     csv_name = "firms_features.csv"
     csv_path = os.path.join(input_dir, csv_name)
 
-    png_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.png')]
+    files = os.listdir(input_dir)
+    png_files = [f for f in files if f.lower().endswith('.png')]
 
     df = pd.read_csv(csv_path)
 
-    filtered_df = df[df['thumbnail_file'].isin(png_files)].copy()
+    exported = df['thumbnail_file'].isin(png_files)
+    if 'patch_file' in df.columns:
+        # EXPORT_MODE "patch" writes no thumbnails, its rows are kept by the patch file
+        npz_files = [f for f in files if f.lower().endswith('.npz')]
+        exported |= df['thumbnail_file'].isna() & df['patch_file'].isin(npz_files)
+
+    filtered_df = df[exported].copy()
+
+    # Thumbnails flagged by thumbnail_quality.py
+    if 'quality_ok' in filtered_df.columns:
+        filtered_df = filtered_df[~filtered_df['quality_ok'].eq(False)]
 
     filtered_df["firms_sensor"] = filtered_df["detecion_source"].apply(lambda x: x.split("_")[0])
-    filtered_df["country"] = filtered_df["detecion_source"].apply(lambda x: "_".join(x.split("_")[1:]))
+    add_region_columns(filtered_df)
 
     filtered_csv_path = os.path.join(input_dir, csv_name.replace('.csv', '_filtered.csv'))
     filtered_df.to_csv(filtered_csv_path, index=False, encoding='utf-8')
@@ -25,6 +38,15 @@ def generate_actualized_df(input_dir):
         return filtered_df
 
 
+def merge_filtered_csvs(csv_paths, merged_csv_path):
+    """Concatenates the filtered CSVs of several runs into merged_csv_path."""
+    dfs = [pd.read_csv(path) for path in csv_paths]
+    merged_df = pd.concat([df for df in dfs if not df.empty] or dfs, ignore_index=True)
+    merged_df.to_csv(merged_csv_path, index=False, encoding='utf-8')
+    print(f"Merged CSV saved to: {merged_csv_path}. Total rows: {len(merged_df)}")
+    return merged_csv_path
+
+
 def generate_all_actualized_df(base_dir):
 
     all_dfs = []
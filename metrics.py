@@ -1,52 +1,48 @@
 import pandas as pd
-from sklearn.cluster import DBSCAN
 import numpy as np
 import datetime
+import argparse
 import os
-import matplotlib.pyplot as plt
-import geopandas as gpd
-import requests
-import zipfile
-import io
+import zlib
+import shutil
+import tempfile
+import concurrent.futures
 
-OUTPUT_DIR = f"data/metrics/{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+from countries import download_natural_earth
+from firms_cube import DIMENSIONS, MEASURES, MISSING_LABEL, aggregate_frame, compact, cube_slice
+from scheduling import bounded_map
 
-def load_world_map():
-    """
-    Downloads Natural Earth '110m admin 0 countries' if not present,
-    extracts it into data/world/, and loads it as a GeoDataFrame.
-    """
-
-    world_dir = "data/world"
-    shapefile_path = os.path.join(world_dir, "ne_110m_admin_0_countries.shp")
+# geopandas, scikit-learn and matplotlib are imported inside the functions that
+# use them so that importing this module stays cheap.
 
-    if not os.path.exists(shapefile_path):
-        print("Downloading Natural Earth world map...")
+INPUT_CSV = "data/fire/firms_features_merged.csv"
+METRICS_DIR = "data/metrics"
 
-        os.makedirs(world_dir, exist_ok=True)
+# Rows of the merged CSV read per map task
+CHUNKSIZE = 200_000
 
-        # ✅ This is the correct working URL from Natural Earth CDN
-        url = "https://naciscdn.org/naturalearth/110m/cultural/ne_110m_admin_0_countries.zip"
+CLOUD_PCT_BINS = np.linspace(0, 100, 11)
 
-        r = requests.get(url)
+# The world map draws the unique fires at their coordinates, a uniform sample of this many when there are more
+MAP_MAX_POINTS = 500_000
 
-        # Check if response is ZIP
-        if r.status_code != 200 or r.content[:2] != b'PK':
-            raise ValueError("Download failed, file is not a valid ZIP. URL may be down.")
-
-        z = zipfile.ZipFile(io.BytesIO(r.content))
-        z.extractall(world_dir)
-
-        print("World map downloaded and extracted successfully.")
+def load_world_map():
+    """
+    Downloads Natural Earth '110m admin 0 countries' if not present,
+    extracts it into data/world/, and loads it as a GeoDataFrame.
+    """
+    import geopandas as gpd
 
-    return gpd.read_file(shapefile_path)
+    return gpd.read_file(download_natural_earth("ne_110m_admin_0_countries", "110m"))
 
 
 def save_world_fire_map(df, output_dir):
     """
     Creates and saves a world map with fire locations as red points.
     """
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
+
     os.makedirs(output_dir, exist_ok=True)
 
     world = load_world_map()
@@ -94,28 +90,38 @@ def save_world_fire_map(df, output_dir):
     plt.close()
     print(f"World fire map saved to: {output_path}")
 
+def cluster_coordinates(coords, max_km=3):
+    """
+    Haversine DBSCAN (min_samples=1) over an array of (latitude, longitude) pairs.
+    Returns one cluster label per coordinate.
+    """
+    from sklearn.cluster import DBSCAN
+
+    kms_per_radian = 6371.0088
+    epsilon = max_km / kms_per_radian
+
+    rad = np.radians(coords)
+
+    clustering = DBSCAN(
+        eps=epsilon,
+        min_samples=1,
+        metric="haversine"
+    ).fit(rad)
+
+    return clustering.labels_
+
 def assign_fire_ids(df, max_km=3):
     df = df.copy()
     df["FIRMS_date"] = pd.to_datetime(df["FIRMS_date"])
     df["day"] = df["FIRMS_date"].dt.date
 
-    kms_per_radian = 6371.0088
-    epsilon = max_km / kms_per_radian
-
     df["fire_id"] = -1
     current_fire_id = 0
 
     for day, day_df in df.groupby("day"):
         coords = day_df[["latitude", "longitude"]].to_numpy()
-        rad = np.radians(coords)
 
-        clustering = DBSCAN(
-            eps=epsilon,
-            min_samples=1,
-            metric="haversine"
-        ).fit(rad)
-
-        labels = clustering.labels_
+        labels = cluster_coordinates(coords, max_km)
 
         for cluster_label in set(labels):
             mask = (labels == cluster_label)
@@ -124,9 +130,14 @@ def assign_fire_ids(df, max_km=3):
 
     return df
 
-def save_country_bar_chart(df, output_dir):
+def save_country_bar_chart(df, output_dir, cube=None):
+    import matplotlib.pyplot as plt
+
+    if cube is None:
+        cube = aggregate_frame(df)
+
     os.makedirs(output_dir, exist_ok=True)
-    country_counts = df['country'].value_counts()
+    country_counts = cube_slice(cube, 'country').drop(MISSING_LABEL, errors='ignore').sort_values(ascending=False)
     plt.figure(figsize=(10,6))
     country_counts.plot(kind='bar', color='skyblue', edgecolor='black')
     plt.xlabel("Country")
@@ -139,17 +150,23 @@ def save_country_bar_chart(df, output_dir):
     plt.close()
     print(f"Country bar chart saved to: {output_path}")
 
-def save_cloud_pct_histogram(df, output_dir):
+def save_cloud_pct_histogram(df, output_dir, hist=None):
     """Create and save histogram of cloud_pct with 10 bins, x-axis ticks every 10,
-    and vertical lines for mean and ±1 std."""
+    and vertical lines for mean and ±1 std. hist=(counts, mean, std) skips reading df."""
+    import matplotlib.pyplot as plt
+
     os.makedirs(output_dir, exist_ok=True)
     
-    cloud_pct = df['cloud_pct'].dropna()
-    mean = cloud_pct.mean()
-    std = cloud_pct.std()
+    if hist is None:
+        cloud_pct = df['cloud_pct'].dropna()
+        counts = np.histogram(cloud_pct, bins=CLOUD_PCT_BINS)[0]
+        mean = cloud_pct.mean()
+        std = cloud_pct.std()
+    else:
+        counts, mean, std = hist
     
     plt.figure()
-    plt.hist(cloud_pct, bins=10, color='skyblue', edgecolor='black')
+    plt.hist(CLOUD_PCT_BINS[:-1], bins=CLOUD_PCT_BINS, weights=counts, color='skyblue', edgecolor='black')
     plt.xlabel("Cloud Percentage")
     plt.ylabel("Frequency")
     plt.title("Histogram of cloud_pct")
@@ -168,17 +185,18 @@ def save_cloud_pct_histogram(df, output_dir):
     plt.close()
     print(f"Histogram saved to: {output_path}")
 
-def get_monthly_fire_counts(df, output_dir):
+def get_monthly_fire_counts(df, output_dir, cube=None):
     """
     Compute fire counts per month across all years,
     save a bar chart, and return the counts as a Series.
     """
-    df = df.copy()
-    df['FIRMS_date'] = pd.to_datetime(df['FIRMS_date'])
-    df['month'] = df['FIRMS_date'].dt.month
+    import matplotlib.pyplot as plt
+
+    if cube is None:
+        cube = aggregate_frame(df)
 
     # Group by month across all years
-    monthly_counts = df.groupby('month').size().sort_index()  # ensures months 1-12 order
+    monthly_counts = cube_slice(cube, 'month').reindex(range(1, 13), fill_value=0)  # months 1-12, without undated rows
 
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
@@ -229,17 +247,18 @@ def get_monthly_fire_counts(df, output_dir):
     plt.close()
     print(f"Monthly fire counts plot saved to: {output_path}")
 
-def get_hourly_fire_counts(df, output_dir):
+def get_hourly_fire_counts(df, output_dir, cube=None):
     """
     Compute fire counts per hour of day across all dates,
     save a bar chart, and return the counts as a Series.
     """
-    df = df.copy()
-    df['FIRMS_date'] = pd.to_datetime(df['FIRMS_date'])
-    df['hour'] = df['FIRMS_date'].dt.hour   # 0–23
+    import matplotlib.pyplot as plt
+
+    if cube is None:
+        cube = aggregate_frame(df)
 
-    # Count fires per hour (0 to 23)
-    hourly_counts = df.groupby('hour').size().reindex(range(24), fill_value=0)
+    # Count fires per hour (0 to 23), without rows of unknown time
+    hourly_counts = cube_slice(cube, 'hour').reindex(range(24), fill_value=0)
 
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
@@ -261,17 +280,128 @@ def get_hourly_fire_counts(df, output_dir):
 
     return hourly_counts
 
-def get_metrics(df): # TODO create each metric also for unique fire df
-    
-    df_with_ids = assign_fire_ids(df, max_km=3)
-    unique_wildfires = df_with_ids["fire_id"].nunique()
-    df_with_ids.to_csv(os.path.join(OUTPUT_DIR, "firms_with_fire_id.csv"), index=False)
-    unique_fires_df = df_with_ids.drop_duplicates(subset="fire_id")
+# ---------------------------
+# Out-of-core map-reduce
+# ---------------------------
+# The merged CSV is read in chunks. Map tasks turn each chunk into small partial
+# aggregates, and the chunk rows are spilled to one file per day. Reduce tasks
+# cluster each day into fires independently. Only one chunk per worker and one
+# day per worker are ever in memory.
+
+def chunk_partials(chunk):
+    """Map step: partial aggregates of one chunk of the merged CSV."""
+    cloud_pct = pd.to_numeric(chunk['cloud_pct'], errors='coerce').dropna().to_numpy()
+    return {
+        'rows': len(chunk),
+        'cloud_n': len(cloud_pct),
+        'cloud_sum': cloud_pct.sum(),
+        'cloud_sumsq': np.square(cloud_pct).sum(),
+        'cloud_hist': np.histogram(cloud_pct, bins=CLOUD_PCT_BINS)[0],
+        'cube': compact(aggregate_frame(chunk)),
+    }
 
-    country_counts_total = df['country'].value_counts().reset_index()
+def merge_partials(total, part):
+    if total is None:
+        return part
+    merged = {k: total[k] + part[k] for k in total if k != 'cube'}
+    cube = pd.concat([total['cube'], part['cube']], ignore_index=True)
+    merged['cube'] = compact(cube.groupby(DIMENSIONS, as_index=False, observed=True, dropna=False)[MEASURES].sum())
+    return merged
+
+def spill_by_day(chunk, spill_dir):
+    """Appends the rows of a chunk to {spill_dir}/{YYYY-MM-DD}.csv, keeping file order inside each day."""
+    days = chunk['FIRMS_date'].astype(str).str[:10]
+    for day, day_chunk in chunk.groupby(days, sort=False):
+        path = os.path.join(spill_dir, f"{day}.csv")
+        day_chunk.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+def cluster_day(path, max_km=3):
+    """
+    Reduce step for one day file: clusters its detections into fires, rewrites the file
+    with day and fire_id (numbered from 0 inside the day) and returns
+    (number of fires, unique fires per country, map points of the unique fires).
+    The map points carry a random key, seeded by the day, for sample_points.
+    """
+    day = os.path.basename(path)[:-len(".csv")]
+    day_df = pd.read_csv(path)
+    labels = cluster_coordinates(day_df[["latitude", "longitude"]].to_numpy(), max_km)
+
+    day_df["day"] = day
+    day_df["fire_id"] = labels
+    day_df.to_csv(path, index=False)
+
+    unique_fires = day_df.drop_duplicates(subset="fire_id")
+    points = unique_fires[["latitude", "longitude"]].reset_index(drop=True)
+    points["key"] = np.random.default_rng(zlib.crc32(day.encode())).random(len(points))
+    return int(labels.max()) + 1, unique_fires['country'].value_counts(), points
+
+def sample_points(sample, points, max_points=MAP_MAX_POINTS):
+    """Bottom-k sample: the max_points rows with the smallest keys of both frames, uniform over all points seen."""
+    if sample is not None:
+        points = pd.concat([sample, points], ignore_index=True)
+    if len(points) > max_points:
+        points = points.nsmallest(max_points, "key")
+    return points
+
+def get_metrics(input_csv, output_dir, chunksize=CHUNKSIZE, num_workers=None, max_km=3): # TODO create each metric also for unique fire df
+    """
+    Computes the metrics and charts of a merged features CSV out of core, with map and
+    reduce tasks spread over worker processes. Peak memory depends on chunksize and on
+    the largest day, not on the size of the CSV.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    spill_dir = tempfile.mkdtemp(prefix="days_", dir=output_dir)
+    max_in_flight = 2 * (num_workers or os.cpu_count())
+
+    totals = None
+    unique_wildfires = 0
+    country_counts_unique = pd.Series(dtype=int)
+    fire_points = None
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+
+            def map_tasks():
+                for chunk in pd.read_csv(input_csv, chunksize=chunksize):
+                    spill_by_day(chunk, spill_dir)
+                    yield chunk_partials, (chunk,), None
+
+            for _, part in bounded_map(executor, map_tasks(), max_in_flight):
+                totals = merge_partials(totals, part)
+
+            day_paths = [os.path.join(spill_dir, f) for f in sorted(os.listdir(spill_dir))]
+            day_tasks = ((cluster_day, (path, max_km), path) for path in day_paths)
+
+            fires_per_day = {}
+            for path, (n_fires, countries, points) in bounded_map(executor, day_tasks, max_in_flight):
+                fires_per_day[path] = n_fires
+                country_counts_unique = country_counts_unique.add(countries, fill_value=0)
+                fire_points = sample_points(fire_points, points)
+
+        # Fire ids follow day order, as in assign_fire_ids: each day is offset by the fires of the previous days
+        fire_id_csv = os.path.join(output_dir, "firms_with_fire_id.csv")
+        with open(fire_id_csv, "w", newline='', encoding='utf-8') as f:
+            for i, path in enumerate(day_paths):
+                day_df = pd.read_csv(path)
+                day_df["fire_id"] += unique_wildfires
+                day_df.to_csv(f, header=(i == 0), index=False)
+                unique_wildfires += fires_per_day[path]
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    if totals is None:
+        print(f"No rows in {input_csv}")
+        return
+
+    cube = totals['cube']
+    if cube['count'].sum() != totals['rows']:
+        raise ValueError(f"Cube counts {cube['count'].sum()} detections out of {totals['rows']} rows")
+
+    # Detections without country are left out of the table and its percentages, as value_counts did
+    country_counts_total = cube_slice(cube, 'country').drop(MISSING_LABEL, errors='ignore').reset_index()
     country_counts_total.columns = ['country', 'count_total']
 
-    country_counts_unique = unique_fires_df['country'].value_counts().reset_index()
+    country_counts_unique = country_counts_unique.rename_axis('country').reset_index()
     country_counts_unique.columns = ['country', 'count_unique']
 
     country_counts = pd.merge(country_counts_total, country_counts_unique, on='country', how='outer').fillna(0)
@@ -282,13 +412,16 @@ def get_metrics(df): # TODO create each metric also for unique fire df
     country_counts['percentage_unique'] = round(100 * country_counts['count_unique'] / country_counts['count_unique'].sum(), 2)
     country_counts['unique_over_total'] = round(100 * country_counts['count_unique'] / country_counts['count_total'], 2)
 
-    country_counts.to_csv(os.path.join(OUTPUT_DIR, "country_counts.csv"), index=False)
+    country_counts.to_csv(os.path.join(output_dir, "country_counts.csv"), index=False)
 
-    cloud_pct_mean = round(df['cloud_pct'].mean(), 3)
-    cloud_pct_std = round(df['cloud_pct'].std(), 3)
+    n = totals['cloud_n']
+    mean = totals['cloud_sum'] / n if n else np.nan
+    std = np.sqrt((totals['cloud_sumsq'] - n * mean ** 2) / (n - 1)) if n > 1 else np.nan
+    cloud_pct_mean = round(mean, 3)
+    cloud_pct_std = round(std, 3)
     print(cloud_pct_mean, cloud_pct_std)
 
-    images_count = len(df)
+    images_count = totals['rows']
 
     metrics = {
         "images_count": images_count,
@@ -301,15 +434,29 @@ def get_metrics(df): # TODO create each metric also for unique fire df
         {"metric": k, "value": v} for k, v in metrics.items()
     ])
 
-    metrics_df.to_csv(os.path.join(OUTPUT_DIR, "metrics.csv"), index=False)
+    metrics_df.to_csv(os.path.join(output_dir, "metrics.csv"), index=False)
 
-    save_world_fire_map(unique_fires_df, OUTPUT_DIR)
-    save_cloud_pct_histogram(df, OUTPUT_DIR)
-    save_country_bar_chart(df, OUTPUT_DIR)
-    get_monthly_fire_counts(df, OUTPUT_DIR)
-    get_hourly_fire_counts(df, OUTPUT_DIR)
+    if unique_wildfires > MAP_MAX_POINTS:
+        print(f"World fire map drawn with a sample of {MAP_MAX_POINTS} of the {unique_wildfires} unique fires")
+    save_world_fire_map(fire_points, output_dir)
+    save_cloud_pct_histogram(None, output_dir, hist=(totals['cloud_hist'], mean, std))
 
-if __name__ == "__main__":
-    df = pd.read_csv("data/fire/firms_features_merged.csv")
+    # Counts by country / month / hour are answered from the merged aggregates
+    save_country_bar_chart(None, output_dir, cube)
+    get_monthly_fire_counts(None, output_dir, cube)
+    get_hourly_fire_counts(None, output_dir, cube)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute metrics and charts for a merged fire features CSV.")
+    parser.add_argument("--input-csv", default=INPUT_CSV)
+    parser.add_argument("--output-dir", default=None, help="Defaults to data/metrics/<timestamp>.")
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    output_dir = args.output_dir or os.path.join(METRICS_DIR, datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
 
-    get_metrics(df)
\ No newline at end of file
+    get_metrics(args.input_csv, output_dir, args.chunksize, args.workers)
+
+if __name__ == "__main__":
+    main()
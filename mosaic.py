@@ -0,0 +1,81 @@
+import numpy as np
+
+from detection_table import METERS_PER_DEGREE
+
+# Largest side (pixels) of one mosaic download request, and of the cells detections are grouped in
+MOSAIC_TILE_PX = 2048
+
+# Largest mosaic (pixels) held in memory by one worker thread, 64 MB as RGBA
+MOSAIC_MAX_PIXELS = 4096 * 4096
+
+def mosaic_grid(bounds, pixel_meters):
+    """
+    EPSG:4326 pixel grid covering bounds (west, south, east, north) with pixels of about
+    pixel_meters. Returns (bounds snapped to whole pixels, width, height).
+    """
+    west, south, east, north = bounds
+    pixel_lat = pixel_meters / METERS_PER_DEGREE
+    pixel_lon = pixel_lat / np.cos(np.radians((south + north) / 2))
+    width = max(1, int(np.ceil((east - west) / pixel_lon)))
+    height = max(1, int(np.ceil((north - south) / pixel_lat)))
+    return (float(west), float(north - height * pixel_lat), float(west + width * pixel_lon), float(north)), width, height
+
+def mosaic_cells(latitudes, longitudes, pixel_meters, tile_px=MOSAIC_TILE_PX):
+    """
+    (row, col) of the cell of a global grid, about tile_px pixels of pixel_meters wide, that
+    contains each coordinate. Detections of an image are downloaded cell by cell, so the area
+    fetched and held in memory does not grow with the spread of the group.
+    """
+    latitudes = np.asarray(latitudes, dtype='f8')
+    cell_deg = tile_px * pixel_meters / METERS_PER_DEGREE
+    rows = np.floor(latitudes / cell_deg)
+    cols = np.floor(np.asarray(longitudes, dtype='f8') * np.cos(np.radians(latitudes)) / cell_deg)
+    return rows.astype('i8'), cols.astype('i8')
+
+def mosaic_tiles(bounds, width, height, tile_px=MOSAIC_TILE_PX):
+    """Yields (x0, y0, tile_width, tile_height, tile_bounds) of the tiles covering a mosaic grid."""
+    west, south, east, north = bounds
+    pixel_lon = (east - west) / width
+    pixel_lat = (north - south) / height
+
+    for y0 in range(0, height, tile_px):
+        for x0 in range(0, width, tile_px):
+            w = min(tile_px, width - x0)
+            h = min(tile_px, height - y0)
+            yield x0, y0, w, h, (
+                float(west + x0 * pixel_lon),
+                float(north - (y0 + h) * pixel_lat),
+                float(west + (x0 + w) * pixel_lon),
+                float(north - y0 * pixel_lat)
+            )
+
+def crop_window(bounds, mosaic_bounds, width, height):
+    """Pixel window (x0, y0, x1, y1) of bounds inside a mosaic grid, at least one pixel wide."""
+    west, south, east, north = mosaic_bounds
+    x = np.array([bounds[0] - west, bounds[2] - west]) / (east - west) * width
+    y = np.array([north - bounds[3], north - bounds[1]]) / (north - south) * height
+    x0, x1 = np.clip(np.round(x), 0, width).astype(int)
+    y0, y1 = np.clip(np.round(y), 0, height).astype(int)
+    return x0, y0, max(x1, x0 + 1), max(y1, y0 + 1)
+
+def crop_mosaic(mosaic_path, mosaic_bounds, crops):
+    """
+    Worker: cuts crops out of a stitched mosaic (.npy, memory mapped) and saves each one
+    resized to its thumbnail size. crops is a list of (filename, bounds, (width, height)).
+    Returns the filenames written.
+    """
+    from PIL import Image
+
+    mosaic = np.load(mosaic_path, mmap_mode='r')
+    height, width = mosaic.shape[:2]
+
+    written = []
+    for filename, bounds, size in crops:
+        try:
+            x0, y0, x1, y1 = crop_window(bounds, mosaic_bounds, width, height)
+            crop = np.ascontiguousarray(mosaic[y0:y1, x0:x1])
+            Image.fromarray(crop, 'RGBA').resize(size, Image.NEAREST).save(filename)
+            written.append(filename)
+        except Exception as e:
+            print(f"Error cropping {filename}: {e}")
+    return written
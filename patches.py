@@ -0,0 +1,145 @@
+import io
+import os
+import argparse
+import requests
+import numpy as np
+import concurrent.futures
+from numpy.lib import recfunctions
+
+# Bands exported in the multispectral patches: the RGB bands of the thumbnails plus
+# the NIR / SWIR bands required by check_valid_image.
+PATCH_BANDS = {
+    "sentinel-2": ['B2', 'B3', 'B4', 'B8', 'B11', 'B12'],
+    "landsat-8": ['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7'],
+    "aqua": ['sur_refl_b01', 'sur_refl_b02', 'sur_refl_b03', 'sur_refl_b04', 'sur_refl_b06', 'sur_refl_b07'],
+    "fengyun": ['Channel0001', 'Channel0002', 'Channel0003']
+}
+
+# Native resolution (meters) of the RGB bands of each satellite: default PATCH_SCALE, mosaic
+# pixel size and scale of the valid-pixel reduction (MIN_VALID_PCT)
+NATIVE_SCALES = {
+    "sentinel-2": 10,
+    "landsat-8": 30,
+    "aqua": 500,
+    "fengyun": 4000
+}
+
+# Bands of the RGB thumbnails (collect_images.download_thumbnail) and of the rgb composite
+RGB_BANDS = {
+    "sentinel-2": ['B4', 'B3', 'B2'],
+    "landsat-8": ['SR_B4', 'SR_B3', 'SR_B2'],
+    "aqua": ['sur_refl_b01', 'sur_refl_b04', 'sur_refl_b03'],
+    "fengyun": ['Channel0001', 'Channel0002', 'Channel0003']
+}
+
+# Band combinations that can be rendered from a patch
+COMPOSITES = {
+    "sentinel-2": {"rgb": RGB_BANDS["sentinel-2"], "false_color": ['B12', 'B8', 'B4']},
+    "landsat-8": {"rgb": RGB_BANDS["landsat-8"], "false_color": ['SR_B7', 'SR_B5', 'SR_B4']},
+    "aqua": {"rgb": RGB_BANDS["aqua"], "false_color": ['sur_refl_b07', 'sur_refl_b02', 'sur_refl_b01']},
+    "fengyun": {"rgb": RGB_BANDS["fengyun"]}
+}
+
+# Display range (min, max) of the thumbnails and rendered patches, Landsat-8 after the
+# REFLECTANCE_SCALE gain / offset. Used by collect_images.download_thumbnail as well.
+STRETCH = {
+    "sentinel-2": (0, 6000),
+    "landsat-8": (0, 0.3),
+    "aqua": (0, 5000),
+    "fengyun": (0, 4000)
+}
+REFLECTANCE_SCALE = {
+    "landsat-8": (0.0000275, -0.2)
+}
+
+def download_patch(image, filename, satellite, region, scale=None, dimensions=None, crs=None, budget=None):
+    """
+    Downloads all PATCH_BANDS of the region in a single NPY getDownloadURL request and stores
+    them as a compressed (height, width, band) array in filename (.npz), with the band names.
+    Masked pixels are 0. dimensions ("WIDTHxHEIGHT") takes precedence over scale.
+    """
+    bands = PATCH_BANDS[satellite]
+    params = {
+        'bands': bands,
+        'region': region,
+        'format': 'NPY',
+    }
+    if dimensions is not None:
+        params['dimensions'] = dimensions
+    else:
+        params['scale'] = scale or NATIVE_SCALES[satellite]
+    if crs is not None:
+        params['crs'] = crs
+
+    try:
+        url = image.select(bands).getDownloadURL(params)
+        r = requests.get(url)
+        if budget is not None:
+            budget.charge(rpcs=1, nbytes=len(r.content))
+        if r.status_code != 200:
+            print(f"Error HTTP {r.status_code} downloading {filename}")
+            return False
+
+        data = np.load(io.BytesIO(r.content))
+        np.savez_compressed(
+            filename,
+            data=recfunctions.structured_to_unstructured(data[bands]),
+            bands=np.array(bands),
+            satellite=satellite
+        )
+        return True
+    except Exception as e:
+        print(f"Error downloading {filename}: {e}")
+    return False
+
+def load_patch(path):
+    """Returns (data, bands, satellite) of a patch file."""
+    with np.load(path) as patch:
+        return patch['data'], [str(b) for b in patch['bands']], str(patch['satellite'])
+
+def render_patch(path, composite="rgb", output_path=None):
+    """Renders a band combination of a patch to an 8-bit PNG, transparent where there is no data."""
+    from PIL import Image
+
+    data, bands, satellite = load_patch(path)
+    if composite not in COMPOSITES[satellite]:
+        raise ValueError(f"Composite {composite} not available for {satellite}. Options are: {list(COMPOSITES[satellite])}")
+
+    rgb = data[..., [bands.index(b) for b in COMPOSITES[satellite][composite]]].astype('f4')
+    nodata = (rgb == 0).all(axis=-1)
+
+    if satellite in REFLECTANCE_SCALE:
+        gain, offset = REFLECTANCE_SCALE[satellite]
+        rgb = rgb * gain + offset
+
+    vmin, vmax = STRETCH[satellite]
+    pixels = np.clip((rgb - vmin) / (vmax - vmin) * 255, 0, 255).astype('u1')
+    alpha = np.where(nodata, 0, 255).astype('u1')
+
+    if output_path is None:
+        output_path = path.replace('.npz', f'_{composite}.png')
+    Image.fromarray(np.dstack([pixels, alpha]), 'RGBA').save(output_path)
+    return output_path
+
+def render_run(run_dir, composite="rgb", num_workers=None):
+    """Renders every patch of a run directory in worker processes."""
+    paths = [os.path.join(run_dir, f) for f in sorted(os.listdir(run_dir)) if f.endswith('.npz')]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        rendered = list(executor.map(render_patch, paths, [composite] * len(paths), chunksize=16))
+
+    print(f"{len(rendered)} {composite} images rendered in {run_dir}")
+    return rendered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render RGB / false colour PNGs from the multispectral patches of a run.")
+    parser.add_argument("run_dir")
+    parser.add_argument("--composite", default="rgb", help="rgb or false_color")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    render_run(args.run_dir, args.composite, args.workers)
+
+if __name__ == "__main__":
+    main()
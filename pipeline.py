@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import datetime
+import argparse
+import threading
+import concurrent.futures
+from pathlib import Path
+from dataclasses import dataclass, field
+
+from download_firms_data import firms_csv_path
+from run_dirs import load_json, save_json
+
+# The stage functions import their modules when they run, so that building and
+# fingerprinting the stage graph stays cheap.
+
+CONFG_FILE_NAME = "config/pipeline_config.json"
+PIPELINE_DIR = "data/pipeline"
+STATE_FILE = "state.json"
+
+# Digest of the detections CSV a collection run was started from, kept in the run directory
+INPUT_DIGEST_FILE = "input_digest"
+
+# Days between downloads of a FIRMS CSV that is still growing (END_YEAR not over)
+REFRESH_DAYS = 7
+
+# Bytes read at a time when hashing files
+HASH_BLOCK = 1 << 20
+
+@dataclass
+class Stage:
+    """
+    One step of the pipeline: func(**params) reads the inputs files and writes the outputs
+    files. It runs after the stages named in deps, and is skipped when its fingerprint
+    (params plus content of the inputs) matches the last successful run.
+    """
+    name: str
+    func: callable
+    params: dict
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    deps: list = field(default_factory=list)
+
+
+# ---------------------------
+# Fingerprints
+# ---------------------------
+
+def config_hash(obj):
+    """Stable hash of a JSON-serializable object."""
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+def file_digest(path, cache):
+    """
+    sha256 of a file's content. cache maps path -> [size, mtime_ns, digest] and is
+    reused while the size and modification time of the file do not change.
+    """
+    stat = os.stat(path)
+    cached = cache.get(path)
+    if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return cached[2]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+
+    cache[path] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+    return cache[path][2]
+
+def stage_fingerprint(stage, cache):
+    inputs = {path: file_digest(path, cache) for path in stage.inputs}
+    return config_hash({"stage": stage.name, "params": stage.params, "inputs": inputs})
+
+def load_state(state_path):
+    return load_json(state_path, {"stages": {}, "files": {}})
+
+
+# ---------------------------
+# Stage functions
+# ---------------------------
+
+def download_stage(country, instrument, end_year, refresh_period=None):
+    """refresh_period only changes the fingerprint, so that a FIRMS CSV that is still growing is downloaded again."""
+    from download_firms_data import download_firms_data
+    download_firms_data(country, instrument, end_year)
+
+def filter_stage(csv_path, output_path, sector):
+    from filter_firms_dataset_sector import filter_csv_by_sector
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    filter_csv_by_sector(csv_path, output_path, sector["NORTE"], sector["SUR"], sector["ESTE"], sector["OESTE"])
+
+def collect_stage(collect_config, run_dir):
+    """
+    Collects the images of one country into run_dir. A run_dir started from the same input
+    is resumed (OLD_RUN_DIR). When the input changed, the detections are matched by
+    coordinates and acquisition time against the input of the run (queue_input_changes):
+    removed ones are dropped from its CSV and only the new ones are collected. A run_dir
+    that cannot be matched (started before input_keys.npz, or stopped without pending.csv)
+    is moved aside (run_dir_<timestamp>) and the collection starts again.
+    Raises if the run stops before completion (BUDGET), so the stage runs again next time.
+    """
+    from collect_images import INPUT_KEYS_FILE, PENDING_FILE, load_config, queue_input_changes, run_collection, save_input_keys
+
+    digest = file_digest(collect_config["CSV_PATH"], {})
+    digest_path = os.path.join(run_dir, INPUT_DIGEST_FILE)
+    completed_path = os.path.join(run_dir, "job_completed")
+    keys_path = os.path.join(run_dir, INPUT_KEYS_FILE)
+
+    resume = os.path.exists(os.path.join(run_dir, "config.json"))
+    changed = False
+    if resume:
+        previous = None
+        if os.path.exists(digest_path):
+            with open(digest_path, "r") as f:
+                previous = f.read().strip()
+        changed = previous != digest
+        matchable = os.path.exists(keys_path) and (
+            os.path.exists(completed_path) or os.path.exists(os.path.join(run_dir, PENDING_FILE))
+        )
+        if changed and not matchable:
+            old_dir = f"{run_dir}_{time.strftime('%Y%m%d_%H%M%S')}"
+            shutil.move(run_dir, old_dir)
+            print(f"Input of {run_dir} changed, previous run moved to {old_dir}")
+            resume, changed = False, False
+
+    os.makedirs(run_dir, exist_ok=True)
+
+    config_path = os.path.join(PIPELINE_DIR, "configs", f"{os.path.basename(run_dir)}.json")
+    os.makedirs(os.path.dirname(config_path), exist_ok=True)
+    with open(config_path, "w") as f:
+        json.dump({**collect_config, "OUTPUT_DIR": run_dir, "OLD_RUN_DIR": run_dir if resume else None}, f, indent=4)
+    config = load_config(config_path)
+
+    n_pending = queue_input_changes(config) if changed else None
+    if not resume or not os.path.exists(keys_path):
+        save_input_keys(config)
+
+    # The digest goes last, so an interrupted update is done again
+    with open(digest_path, "w") as f:
+        f.write(digest)
+
+    if n_pending == 0:
+        Path(completed_path).touch()
+        return
+
+    if os.path.exists(completed_path):
+        os.remove(completed_path)
+
+    run_collection(config)
+
+    if not os.path.exists(completed_path):
+        raise RuntimeError(f"Collection in {run_dir} did not complete, run the pipeline again to resume it")
+
+def clean_stage(run_dir):
+    from generate_clean_df_data import generate_actualized_df
+    generate_actualized_df(run_dir)
+
+def merge_stage(csv_paths, merged_csv_path):
+    from generate_clean_df_data import merge_filtered_csvs
+    merge_filtered_csvs(csv_paths, merged_csv_path)
+
+def metrics_stage(input_csv, output_dir, num_workers):
+    from metrics import get_metrics
+    get_metrics(input_csv, output_dir, num_workers=num_workers)
+
+
+# ---------------------------
+# Stage graph
+# ---------------------------
+
+def load_pipeline_config(config_file=CONFG_FILE_NAME):
+    with open(config_file, "r") as f:
+        config = json.load(f)
+
+    if not config.get("COUNTRIES"):
+        raise ValueError("COUNTRIES must be specified in the config file.")
+
+    with open(config["COLLECT_CONFIG"], "r") as f:
+        config["COLLECT"] = json.load(f)
+
+    return config
+
+def refresh_period(config, end_year):
+    """
+    Number of REFRESH_DAYS periods since year 1 while END_YEAR has not ended, None after.
+    Part of the download fingerprint: the FIRMS CSV of the current year is downloaded again
+    every REFRESH_DAYS days, the CSV of past years is downloaded once.
+    """
+    today = datetime.date.today()
+    if end_year < today.year:
+        return None
+    return today.toordinal() // config.get("REFRESH_DAYS", REFRESH_DAYS)
+
+def country_stages(config, country):
+    """download -> (sector filter) -> collect -> clean stages of one country."""
+    instrument = config["FIRMS_INSTRUMENT"]
+    satellite = config["COLLECT"]["IMAGES_SATELLITE"]
+    slug = f"{instrument}_{country}".replace(' ', '_')
+
+    csv_path = firms_csv_path(country, instrument)
+    end_year = config.get("END_YEAR", 2024)
+    stages = [Stage(
+        name=f"download:{country}",
+        func=download_stage,
+        params={"country": country, "instrument": instrument, "end_year": end_year, "refresh_period": refresh_period(config, end_year)},
+        outputs=[csv_path]
+    )]
+
+    sector = config.get("SECTORS", {}).get(country)
+    if sector is not None:
+        # Named after the FIRMS file (instrument code first): collect_images logs it as
+        # detecion_source and generate_clean_df_data takes firms_sensor from its first token
+        filtered_name = os.path.basename(csv_path).replace('.csv', '_sector.csv')
+        filtered_path = os.path.join(PIPELINE_DIR, "filtered", filtered_name)
+        stages.append(Stage(
+            name=f"filter:{country}",
+            func=filter_stage,
+            params={"csv_path": csv_path, "output_path": filtered_path, "sector": sector},
+            inputs=[csv_path],
+            outputs=[filtered_path],
+            deps=[stages[-1].name]
+        ))
+        csv_path = filtered_path
+
+    # The run directory is named after the collection config, so a config change starts a new
+    # run instead of resuming one made with other parameters (see collect_stage for input changes).
+    collect_config = {
+        **config["COLLECT"],
+        "COUNTRY": country,
+        "FIRMS_INSTRUMENT": instrument,
+        "CSV_PATH": csv_path,
+        "OLD_RUN_DIR": None
+    }
+    collect_config.pop("OUTPUT_DIR", None)
+    run_dir = os.path.join(config.get("RUNS_DIR", "data/fire"), f"{slug}_{satellite}_{config_hash(collect_config)[:8]}")
+    features_csv = os.path.join(run_dir, "firms_features.csv")
+    stages.append(Stage(
+        name=f"collect:{country}",
+        func=collect_stage,
+        params={"collect_config": collect_config, "run_dir": run_dir},
+        inputs=[csv_path],
+        outputs=[features_csv],
+        deps=[stages[-1].name]
+    ))
+
+    stages.append(Stage(
+        name=f"clean:{country}",
+        func=clean_stage,
+        params={"run_dir": run_dir},
+        inputs=[features_csv],
+        outputs=[os.path.join(run_dir, "firms_features_filtered.csv")],
+        deps=[stages[-1].name]
+    ))
+    return stages
+
+def build_stages(config):
+    """Per-country chains, then the merge of their clean CSVs and the metrics."""
+    stages = []
+    for country in config["COUNTRIES"]:
+        stages.extend(country_stages(config, country))
+
+    clean = [s for s in stages if s.name.startswith("clean:")]
+    filtered_csvs = [s.outputs[0] for s in clean]
+    merged_csv = os.path.join(PIPELINE_DIR, "firms_features_merged.csv")
+    metrics_dir = config.get("METRICS_DIR", "data/metrics/pipeline")
+
+    stages.append(Stage(
+        name="merge",
+        func=merge_stage,
+        params={"csv_paths": filtered_csvs, "merged_csv_path": merged_csv},
+        inputs=filtered_csvs,
+        outputs=[merged_csv],
+        deps=[s.name for s in clean]
+    ))
+    stages.append(Stage(
+        name="metrics",
+        func=metrics_stage,
+        params={"input_csv": merged_csv, "output_dir": metrics_dir, "num_workers": config.get("METRICS_WORKERS")},
+        inputs=[merged_csv],
+        outputs=[os.path.join(metrics_dir, "firms_with_fire_id.csv")],
+        deps=["merge"]
+    ))
+    return stages
+
+
+# ---------------------------
+# Runner
+# ---------------------------
+
+def run_pipeline(stages, state_path=os.path.join(PIPELINE_DIR, STATE_FILE), max_workers=4, force=False):
+    """
+    Runs the stages in dependency order, up to max_workers at a time. A stage whose
+    fingerprint and outputs are unchanged since its last success is skipped; a failed
+    stage is reported and its dependents are not run. Returns {name: status}.
+    """
+    by_name = {s.name: s for s in stages}
+    state = load_state(state_path)
+    lock = threading.Lock()
+    status = {}
+
+    def run(stage):
+        with lock:
+            fingerprint = stage_fingerprint(stage, state["files"])
+        up_to_date = (
+            not force
+            and state["stages"].get(stage.name) == fingerprint
+            and all(os.path.exists(path) for path in stage.outputs)
+        )
+        if up_to_date:
+            return "skipped"
+
+        print(f"[{stage.name}] running")
+        stage.func(**stage.params)
+
+        with lock:
+            state["stages"][stage.name] = fingerprint
+            save_json(state, state_path)
+        return "done"
+
+    pending = list(stages)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+        while pending or in_flight:
+            for stage in list(pending):
+                dep_status = [status.get(d) for d in stage.deps]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    status[stage.name] = "blocked"
+                    pending.remove(stage)
+                elif all(s in ("done", "skipped") for s in dep_status):
+                    in_flight[executor.submit(run, stage)] = stage
+                    pending.remove(stage)
+
+            if not in_flight:
+                break
+
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                stage = in_flight.pop(future)
+                try:
+                    status[stage.name] = future.result()
+                except Exception as e:
+                    print(f"[{stage.name}] failed: {e}")
+                    status[stage.name] = "failed"
+
+    for name in by_name:
+        print(f"{name}: {status.get(name, 'blocked')}")
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run download -> sector filter -> collect -> clean -> metrics, skipping unchanged stages.")
+    parser.add_argument("--config", default=CONFG_FILE_NAME, help="JSON config file (see config/pipeline_config_example.json).")
+    parser.add_argument("--workers", type=int, default=None, help="Stages run at the same time (MAX_WORKERS of the config by default)")
+    parser.add_argument("--force", action="store_true", help="Run every stage even if its fingerprint is unchanged")
+    args = parser.parse_args(argv)
+
+    config = load_pipeline_config(args.config)
+    stages = build_stages(config)
+    run_pipeline(
+        stages,
+        os.path.join(PIPELINE_DIR, STATE_FILE),
+        args.workers or config.get("MAX_WORKERS", 4),
+        args.force
+    )
+
+if __name__ == "__main__":
+    main()
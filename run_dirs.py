@@ -0,0 +1,48 @@
+import os
+import json
+import concurrent.futures
+
+# Helpers shared by the scripts that post-process every collection run (thumbnail_quality,
+# thumbnail_derivatives) and by the JSON manifests / state files (firms_cube, pipeline).
+
+BASE_DIR = "data/fire"
+FEATURES_CSV = "firms_features.csv"
+
+def load_json(path, default):
+    """Content of a JSON file, or default if it does not exist."""
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_json(obj, path):
+    """Writes obj as JSON through a temporary file, so an interrupted write never leaves it truncated."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def find_run_dirs(base_dir=BASE_DIR, csv_name=FEATURES_CSV):
+    """Subdirectories of base_dir that have the CSV of a collection run."""
+    return [
+        os.path.join(base_dir, d) for d in sorted(os.listdir(base_dir))
+        if os.path.exists(os.path.join(base_dir, d, csv_name))
+    ]
+
+def for_each_run(func, base_dir=BASE_DIR, csv_name=FEATURES_CSV, num_workers=None, **kwargs):
+    """
+    Calls func(run_dir, executor, csv_name=csv_name, **kwargs) on every run directory of
+    base_dir, one run after the other, sharing one process pool. Returns {run_dir: result}.
+    """
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for run_dir in find_run_dirs(base_dir, csv_name):
+            results[run_dir] = func(run_dir, executor, csv_name=csv_name, **kwargs)
+    return results
+
+def add_run_arguments(parser):
+    """--base-dir, --csv-name and --workers options of the scripts run with for_each_run."""
+    parser.add_argument("--base-dir", default=BASE_DIR, help="Directory containing the run directories")
+    parser.add_argument("--csv-name", default=FEATURES_CSV, help="CSV of each run (no_fire_images.csv for no-fire runs)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (one per CPU by default)")
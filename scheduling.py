@@ -0,0 +1,167 @@
+import time
+import functools
+import threading
+import pandas as pd
+import concurrent.futures
+
+# ---------------------------
+# Priority functions
+# ---------------------------
+# A priority function receives the FIRMS detections DataFrame and returns it
+# reordered, most valuable detections first. The index is kept so that
+# point_{idx} file names stay stable whatever the processing order.
+
+PRIORITY_FUNCTIONS = {}
+
+def register_priority(name):
+    """Decorator that makes a priority function available under `name` (PRIORITY in the config)."""
+    def decorator(func):
+        PRIORITY_FUNCTIONS[name] = func
+        return func
+    return decorator
+
+def prioritize(df, priority="newest"):
+    """Reorders detections with a registered priority name or a callable."""
+    if callable(priority):
+        return priority(df)
+    if priority not in PRIORITY_FUNCTIONS:
+        raise ValueError(f"Invalid priority {priority}. Options are: {list(PRIORITY_FUNCTIONS)}")
+    return PRIORITY_FUNCTIONS[priority](df)
+
+def confidence_score(confidence):
+    """FIRMS confidence as a number: MODIS is 0-100, VIIRS is l/n/h (low/nominal/high)."""
+    viirs_levels = {'l': 20, 'low': 20, 'n': 60, 'nominal': 60, 'h': 90, 'high': 90}
+    numeric = pd.to_numeric(confidence, errors='coerce')
+    labels = confidence.astype(str).str.lower().map(viirs_levels)
+    return numeric.fillna(labels).fillna(0)
+
+@register_priority("newest")
+def newest_first(df):
+    return df.sort_values(by=['acq_date', 'acq_time'], ascending=[False, False], kind='stable')
+
+@register_priority("frp")
+def highest_frp_first(df):
+    return df.sort_values(by='frp', ascending=False, kind='stable')
+
+@register_priority("confidence")
+def highest_confidence_first(df):
+    order = pd.DataFrame({'confidence': confidence_score(df['confidence']), 'frp': df.get('frp', 0)}, index=df.index)
+    return df.loc[order.sort_values(by=['confidence', 'frp'], ascending=False, kind='stable').index]
+
+@register_priority("cluster_representative")
+def cluster_representatives_first(df, max_km=3):
+    """
+    One detection per spatial cluster (same day, haversine DBSCAN as in metrics.assign_fire_ids),
+    the one with the highest FRP, goes first. The remaining members follow.
+    """
+    from metrics import cluster_coordinates
+
+    cluster_ids = pd.Series(-1, index=df.index)
+    next_id = 0
+    for _, day_df in df.groupby('acq_date'):
+        labels = cluster_coordinates(day_df[['latitude', 'longitude']].to_numpy(), max_km)
+        cluster_ids.loc[day_df.index] = labels + next_id
+        next_id += labels.max() + 1
+
+    order = pd.DataFrame({'cluster': cluster_ids, 'frp': df.get('frp', 0)}, index=df.index)
+    order = order.sort_values(by='frp', ascending=False, kind='stable')
+    order['rank'] = order.groupby('cluster').cumcount()
+    return df.loc[order.sort_values(by='rank', kind='stable').index]
+
+# Side in degrees of the grid cells of the "stratified" priority (same 1° grid as firms_cube)
+STRATUM_CELL_DEG = 1
+
+@register_priority("stratified")
+def stratified_round_robin(df):
+    """
+    Round robin over 1° grid cell x month strata (highest FRP first inside each stratum).
+    Only columns of the raw FIRMS CSV are used, so it works on any country file.
+    """
+    strata = [
+        (df['latitude'] // STRATUM_CELL_DEG).astype(int),
+        (df['longitude'] // STRATUM_CELL_DEG).astype(int),
+        df['acq_date'].astype(str).str[:7]
+    ]
+
+    ordered = df.sort_values(by='frp', ascending=False, kind='stable') if 'frp' in df.columns else df
+    rank = ordered.groupby(strata).cumcount()
+    return df.loc[rank.sort_values(kind='stable').index]
+
+
+# ---------------------------
+# Budget
+# ---------------------------
+
+class Budget:
+    """
+    Thread-safe wall-clock / Earth Engine RPC / downloaded bytes budget for a collection run.
+    A limit set to None is not enforced.
+    """
+
+    def __init__(self, max_seconds=None, max_rpcs=None, max_bytes=None):
+        self.max_seconds = max_seconds
+        self.max_rpcs = max_rpcs
+        self.max_bytes = max_bytes
+        self.rpcs = 0
+        self.bytes = 0
+        self.start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def charge(self, rpcs=0, nbytes=0):
+        with self._lock:
+            self.rpcs += rpcs
+            self.bytes += nbytes
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def exhausted(self):
+        if self.max_seconds is not None and self.elapsed >= self.max_seconds:
+            return True
+        if self.max_rpcs is not None and self.rpcs >= self.max_rpcs:
+            return True
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            return True
+        return False
+
+    def summary(self):
+        return f"{self.elapsed:.0f} s, {self.rpcs} RPCs, {self.bytes / 1e6:.1f} MB"
+
+def unless_exhausted(func, budget):
+    """func wrapped to return False, without running, once the budget is exhausted."""
+    if budget is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        if budget.exhausted():
+            return False
+        return func(*args)
+    return wrapper
+
+
+# ---------------------------
+# Bounded submission
+# ---------------------------
+
+def bounded_map(executor, tasks, max_in_flight):
+    """
+    Submits (func, args, key) tasks pulled lazily from an iterable, keeping at most
+    max_in_flight of them submitted at any time. Yields (key, result) as tasks finish,
+    so memory does not grow with the number of tasks.
+    """
+    in_flight = {}
+
+    def finished():
+        done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            yield in_flight.pop(future), future.result()
+
+    for func, args, key in tasks:
+        if len(in_flight) >= max_in_flight:
+            yield from finished()
+        in_flight[executor.submit(func, *args)] = key
+
+    while in_flight:
+        yield from finished()
@@ -0,0 +1,30 @@
+import ee
+import pandas as pd
+
+import collect_images
+from collect_images import COLUMNS, CollectConfig, done_event_ids, process_single_event
+from detection_table import detection_table_from_df
+
+def test_event_id_with_two_images_per_event(tmp_path, monkeypatch):
+    df = pd.DataFrame({
+        'latitude': [-32.0, -32.01],
+        'longitude': [-55.0, -55.01],
+        'acq_date': ['2023-01-05', '2023-01-05'],
+        'acq_time': [1200, 1200],
+    })
+    config = CollectConfig(None, 'sentinel-2', 'Uruguay', 'VIIRS S-NPP', 'in.csv', str(tmp_path),
+                           max_images_per_point=2, collection_mode='event')
+    table = detection_table_from_df(df, config.max_time_diff_hours, config.buffer_meters)
+    pd.DataFrame(columns=COLUMNS).to_csv(config.output_csv, index=False)
+
+    img_info = {'properties': {'system:time_start': 1672920000000}}
+    monkeypatch.setattr(ee.Geometry, 'Rectangle', staticmethod(lambda coords: coords))
+    monkeypatch.setattr(collect_images, 'select_images', lambda *args: (2, [(0, None, img_info), (1, None, img_info)]))
+    monkeypatch.setattr(collect_images, 'export_image', lambda image, name, *args: (f"{name}.png", None))
+
+    assert process_single_event(12, [0, 1], table, config)
+
+    rows = pd.read_csv(config.output_csv)
+    assert list(rows['thumbnail_file']) == ['event_12_1.png'] * 2 + ['event_12_2.png'] * 2
+    assert list(rows['event_id']) == [12] * 4
+    assert done_event_ids(str(tmp_path)) == {12}
@@ -0,0 +1,17 @@
+import pandas as pd
+
+from collect_images import COLUMNS, CollectConfig, append_results, migrate_output_csv
+
+def test_resume_of_a_run_with_the_old_columns(tmp_path):
+    config = CollectConfig(None, 'sentinel-2', 'Uruguay', 'VIIRS S-NPP', 'in.csv', str(tmp_path))
+    old = pd.DataFrame([[-32.0, -55.0, '2023-01-05T12:00:00', 'quarantine']], columns=['latitude', 'longitude', 'FIRMS_date', 'note'])
+    old.to_csv(config.output_csv, index=False)
+
+    migrate_output_csv(config.output_csv)
+    append_results([[-33.0, -56.0, '2023-01-06T12:00:00'] + [None] * (len(COLUMNS) - 3)], config)
+
+    df = pd.read_csv(config.output_csv)
+    assert list(df.columns) == COLUMNS + ['note']
+    assert list(df['latitude']) == [-32.0, -33.0]
+    assert list(df['FIRMS_date']) == ['2023-01-05T12:00:00', '2023-01-06T12:00:00']
+    assert df['note'].iloc[0] == 'quarantine' and pd.isna(df['note'].iloc[1])
@@ -0,0 +1,171 @@
+import os
+import argparse
+import pandas as pd
+
+from run_dirs import FEATURES_CSV, add_run_arguments, find_run_dirs, for_each_run, load_json, save_json
+
+DERIVATIVES_DIR = "derivatives"
+MANIFEST_FILE = "manifest.json"
+
+# Output formats: Pillow format and file extension
+FORMATS = {
+    "png": ("PNG", ".png"),
+    "webp": ("WEBP", ".webp"),
+    "jpeg": ("JPEG", ".jpg"),
+}
+DEFAULT_QUALITY = 90
+
+# Columns of the first detection of a thumbnail that identify its image across runs
+KEY_COLUMNS = ['latitude', 'longitude', 'FIRMS_date', 'image_date']
+
+def derivative_name(size, fmt, quality=DEFAULT_QUALITY):
+    """Directory (and manifest key) of a derivative spec inside {run_dir}/derivatives."""
+    return f"{size}_{fmt}" if fmt == "png" else f"{size}_{fmt}_q{quality}"
+
+def derivative_path(run_dir, thumbnail_file, size, fmt, quality=DEFAULT_QUALITY):
+    """Path of the derivative of a thumbnail of a run."""
+    stem = os.path.splitext(thumbnail_file)[0]
+    return os.path.join(run_dir, DERIVATIVES_DIR, derivative_name(size, fmt, quality), stem + FORMATS[fmt][1])
+
+def make_derivatives(master_path, outputs):
+    """
+    Worker: decodes a master thumbnail once and writes each (output_path, size, fmt, quality)
+    with its longest side resized to size by area averaging. Sizes above the master are not
+    upsampled, and the master is not decoded when all of them are. Returns (written, skipped)
+    output paths.
+    """
+    from PIL import Image
+
+    written, skipped = [], []
+    try:
+        with Image.open(master_path) as master:
+            longest = max(master.size)
+            skipped = [output[0] for output in outputs if output[1] > longest]
+            outputs = [output for output in outputs if output[1] <= longest]
+            if not outputs:
+                return written, skipped
+            master = master.convert('RGBA')
+    except Exception as e:
+        print(f"Error reading {master_path}: {e}")
+        return written, skipped
+
+    for output_path, size, fmt, quality in outputs:
+        try:
+            scale = size / max(master.size)
+            resized = master.resize(
+                (max(1, round(master.width * scale)), max(1, round(master.height * scale))),
+                Image.BOX
+            )
+            # JPEG has no alpha, no-data pixels are already black in the thumbnails
+            if fmt == "jpeg":
+                resized = resized.convert('RGB')
+
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            resized.save(output_path, FORMATS[fmt][0], quality=quality)
+            written.append(output_path)
+        except Exception as e:
+            print(f"Error writing {output_path}: {e}")
+    return written, skipped
+
+def run_thumbnails(run_dir, csv_name=FEATURES_CSV):
+    """
+    (THUMB_SIZE, {thumbnail_file: key}) of the thumbnails on disk of a collection run. The key
+    identifies the same image in runs of another THUMB_SIZE: satellite, buffer and collection
+    mode of the run config, and KEY_COLUMNS of the first detection of the thumbnail.
+    Runs without config.json (no-fire runs, random dates) are not matched: (0, {}).
+    """
+    config = load_json(os.path.join(run_dir, "config.json"), None)
+    if config is None:
+        return 0, {}
+
+    satellite = config.get("IMAGES_SATELLITE")
+    buffer_meters = config.get("BUFFER_METERS")
+    if isinstance(buffer_meters, dict):
+        buffer_meters = buffer_meters.get(satellite, buffer_meters.get("default"))
+    run_key = (satellite, buffer_meters, config.get("COLLECTION_MODE", "point"))
+
+    df = pd.read_csv(os.path.join(run_dir, csv_name), usecols=lambda col: col in KEY_COLUMNS + ['thumbnail_file'])
+    df = df.dropna(subset=['thumbnail_file']).drop_duplicates('thumbnail_file')
+    df = df[[os.path.exists(os.path.join(run_dir, f)) for f in df['thumbnail_file']]]
+    keys = df.reindex(columns=KEY_COLUMNS).astype(str).itertuples(index=False, name=None)
+    return config.get("THUMB_SIZE", 0), {f: run_key + key for f, key in zip(df['thumbnail_file'], keys)}
+
+def largest_masters(run_dirs, csv_name=FEATURES_CSV):
+    """
+    {(run_dir, thumbnail_file): master_path}: the thumbnail of the same image (see run_thumbnails)
+    with the largest THUMB_SIZE among run_dirs, so derivatives come from the largest download.
+    """
+    thumbnails, largest = {}, {}
+    for run_dir in run_dirs:
+        thumb_size, keys = run_thumbnails(run_dir, csv_name)
+        for thumbnail_file, key in keys.items():
+            thumbnails[(run_dir, thumbnail_file)] = key
+            if key not in largest or thumb_size > largest[key][0]:
+                largest[key] = (thumb_size, os.path.join(run_dir, thumbnail_file))
+    return {thumbnail: largest[key][1] for thumbnail, key in thumbnails.items()}
+
+def manifest_path(run_dir):
+    return os.path.join(run_dir, DERIVATIVES_DIR, MANIFEST_FILE)
+
+def build_run_derivatives(run_dir, executor, specs, csv_name=FEATURES_CSV, masters=None):
+    """
+    Builds the (size, fmt, quality) specs of every thumbnail of a run directory from its master:
+    the largest thumbnail of the same image in masters (see largest_masters), or the thumbnail
+    itself. {run_dir}/derivatives/manifest.json records the master path, size and modification
+    time each derivative was built from, so only new or changed thumbnails, or thumbnails with
+    a larger master, are processed. Sizes above the master are not recorded, they are built once
+    a larger master is downloaded. Returns the number of derivatives written.
+    """
+    masters = masters or {}
+    df = pd.read_csv(os.path.join(run_dir, csv_name), usecols=['thumbnail_file'])
+    thumbnails = [f for f in df['thumbnail_file'].dropna().unique() if os.path.exists(os.path.join(run_dir, f))]
+
+    manifest = load_json(manifest_path(run_dir), {})
+    names = [derivative_name(*spec) for spec in specs]
+
+    masters_used, tasks = [], []
+    for thumbnail_file in thumbnails:
+        master_path = masters.get((run_dir, thumbnail_file), os.path.join(run_dir, thumbnail_file))
+        stat = os.stat(master_path)
+        master = [os.path.relpath(master_path, run_dir), stat.st_size, stat.st_mtime_ns]
+
+        outputs = [
+            (derivative_path(run_dir, thumbnail_file, *spec), *spec)
+            for name, spec in zip(names, specs)
+            if manifest.get(name, {}).get(thumbnail_file) != master
+        ]
+        if outputs:
+            masters_used.append((thumbnail_file, master))
+            tasks.append((master_path, outputs))
+
+    results = executor.map(make_derivatives, *zip(*tasks), chunksize=16) if tasks else []
+
+    n_written = n_skipped = 0
+    for (thumbnail_file, master), (written, skipped) in zip(masters_used, results):
+        written = set(written)
+        for name, spec in zip(names, specs):
+            if derivative_path(run_dir, thumbnail_file, *spec) in written:
+                manifest.setdefault(name, {})[thumbnail_file] = master
+        n_written += len(written)
+        n_skipped += len(skipped)
+
+    if tasks:
+        save_json(manifest, manifest_path(run_dir))
+
+    print(f"{run_dir}: {n_written} derivatives written from {len(tasks)} thumbnails, {n_skipped} larger than their master ({', '.join(names)})")
+    return n_written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build smaller thumbnails (PNG / WebP / JPEG) locally from the downloaded ones, without new downloads.")
+    add_run_arguments(parser)
+    parser.add_argument("--sizes", type=int, nargs="+", required=True, help="Longest side in pixels of each derivative")
+    parser.add_argument("--format", default="png", choices=list(FORMATS))
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help="WebP / JPEG quality")
+    args = parser.parse_args(argv)
+
+    specs = [(size, args.format, args.quality) for size in args.sizes]
+    masters = largest_masters(find_run_dirs(args.base_dir, args.csv_name), args.csv_name)
+    for_each_run(build_run_derivatives, args.base_dir, args.csv_name, args.workers, specs=specs, masters=masters)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+from run_dirs import FEATURES_CSV, add_run_arguments, for_each_run
+
+QUARANTINE_DIR = "quarantine"
+
+STATS_COLUMNS = ['nodata_pct', 'saturated_pct', 'brightness']
+QUALITY_COLUMNS = STATS_COLUMNS + ['quality_ok']
+
+# Default thresholds of a usable thumbnail
+MAX_NODATA_PCT = 50
+MAX_SATURATED_PCT = 20
+MIN_BRIGHTNESS = 5
+
+def image_quality(path):
+    """
+    Decodes a thumbnail and returns (nodata_pct, saturated_pct, brightness).
+    No-data pixels are transparent or pure black. Saturation and brightness (0-255)
+    are measured over the valid pixels only.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            pixels = np.asarray(img.convert('RGBA'))
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+        return 100.0, 0.0, 0.0
+
+    rgb = pixels[..., :3]
+    rgb_max = rgb.max(axis=-1)
+    valid = (pixels[..., 3] > 0) & (rgb_max > 0)
+    n_valid = int(valid.sum())
+
+    nodata_pct = 100 * (1 - n_valid / valid.size)
+    if n_valid == 0:
+        return nodata_pct, 0.0, 0.0
+
+    saturated_pct = 100 * np.count_nonzero(rgb_max[valid] == 255) / n_valid
+    brightness = float(rgb[valid].mean())
+    return nodata_pct, saturated_pct, brightness
+
+def quality_flags(df, max_nodata_pct=MAX_NODATA_PCT, max_saturated_pct=MAX_SATURATED_PCT, min_brightness=MIN_BRIGHTNESS):
+    """quality_ok of each row from its stats columns. Rows without stats are left as NaN."""
+    ok = (
+        (df['nodata_pct'] <= max_nodata_pct)
+        & (df['saturated_pct'] <= max_saturated_pct)
+        & (df['brightness'] >= min_brightness)
+    )
+    return ok.astype(object).where(df['nodata_pct'].notna())
+
+def assess_run(run_dir, executor, csv_name=FEATURES_CSV, quarantine=False, **thresholds):
+    """
+    Computes the stats of the thumbnails of a run directory that were not assessed yet,
+    writes them with quality_ok into its CSV and, with quarantine, moves the bad
+    thumbnails to {run_dir}/quarantine. Returns (assessed, bad) counts.
+    """
+    csv_path = os.path.join(run_dir, csv_name)
+    df = pd.read_csv(csv_path)
+
+    for col in STATS_COLUMNS:
+        if col not in df.columns:
+            df[col] = np.nan
+
+    pending = df.loc[df['nodata_pct'].isna() & df['thumbnail_file'].notna(), 'thumbnail_file'].unique()
+    pending = [f for f in pending if os.path.exists(os.path.join(run_dir, f))]
+
+    paths = [os.path.join(run_dir, f) for f in pending]
+    stats = pd.DataFrame(list(executor.map(image_quality, paths, chunksize=16)), index=pending, columns=STATS_COLUMNS)
+
+    if len(stats):
+        assessed = df['thumbnail_file'].isin(stats.index)
+        for col in STATS_COLUMNS:
+            df.loc[assessed, col] = df.loc[assessed, 'thumbnail_file'].map(stats[col]).round(2)
+
+    df['quality_ok'] = quality_flags(df, **thresholds)
+
+    bad_files = df.loc[df['quality_ok'].eq(False), 'thumbnail_file'].unique()
+    if quarantine:
+        quarantine_dir = os.path.join(run_dir, QUARANTINE_DIR)
+        for filename in bad_files:
+            path = os.path.join(run_dir, filename)
+            if os.path.exists(path):
+                os.makedirs(quarantine_dir, exist_ok=True)
+                shutil.move(path, os.path.join(quarantine_dir, filename))
+
+    tmp_path = csv_path + ".tmp"
+    df.to_csv(tmp_path, index=False, encoding='utf-8')
+    os.replace(tmp_path, csv_path)
+
+    print(f"{run_dir}: {len(pending)} thumbnails assessed, {len(bad_files)} bad")
+    return len(pending), len(bad_files)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flag (and optionally quarantine) empty, saturated or dark thumbnails of collection runs.")
+    add_run_arguments(parser)
+    parser.add_argument("--quarantine", action="store_true", help=f"Move bad thumbnails to <run>/{QUARANTINE_DIR}")
+    parser.add_argument("--max-nodata-pct", type=float, default=MAX_NODATA_PCT)
+    parser.add_argument("--max-saturated-pct", type=float, default=MAX_SATURATED_PCT)
+    parser.add_argument("--min-brightness", type=float, default=MIN_BRIGHTNESS)
+    args = parser.parse_args(argv)
+
+    for_each_run(
+        assess_run,
+        args.base_dir,
+        args.csv_name,
+        args.workers,
+        quarantine=args.quarantine,
+        max_nodata_pct=args.max_nodata_pct,
+        max_saturated_pct=args.max_saturated_pct,
+        min_brightness=args.min_brightness
+    )
+
+if __name__ == "__main__":
+    main()